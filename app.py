@@ -8,19 +8,43 @@ __version__ = '1.5.0'
 
 from flask import Flask, render_template, jsonify, request, g, Response
 from apscheduler.schedulers.background import BackgroundScheduler
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
 import requests as http_requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sqlite3
 import logging
 import os
 import json
+import hashlib
 import time
 import re
 import threading
 import queue
+import random
+import socket
+import sys
+import uuid
 import atexit
+import multiprocessing
+import base64
+import gzip
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, urlencode, urljoin, urlsplit, urlunsplit, parse_qsl
+from html import unescape
+
+try:
+    import brotli  # Optionnel : compression br des reponses API
+except ImportError:
+    brotli = None
 
 # Configuration du logging
 logging.basicConfig(
@@ -36,7 +60,72 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-key-change-me-in-production'
 # Configuration
 DB_PATH = Path(os.getenv('DATABASE_PATH', 'data/app.db'))
 SCAN_INTERVAL_MINUTES = int(os.getenv('SCAN_INTERVAL', '15'))
+# Planification adaptative : un job par site, intervalle borne selon la frequence
+# des changements observes (SCAN_INTERVAL sert pour un site encore jamais scanne)
+SCAN_ADAPTIVE = os.getenv('SCAN_ADAPTIVE', 'true').lower() in ('1', 'true', 'yes')
+SCAN_MIN_INTERVAL = int(os.getenv('SCAN_MIN_INTERVAL', '5'))
+SCAN_MAX_INTERVAL = int(os.getenv('SCAN_MAX_INTERVAL', '120'))
+SCAN_JITTER_SECONDS = int(os.getenv('SCAN_JITTER_SECONDS', '60'))
+SCAN_CHANGE_WINDOW_DAYS = int(os.getenv('SCAN_CHANGE_WINDOW_DAYS', '7'))
 REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '30'))
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', '4'))
+HOST_MIN_INTERVAL = float(os.getenv('HOST_MIN_INTERVAL', '2'))
+HOST_MAX_CONCURRENCY = int(os.getenv('HOST_MAX_CONCURRENCY', '1'))
+HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', '32'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '4'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '1'))
+# Historique des prix : 'changes' (une ligne par changement d'etat) ou 'full' (une ligne par scan)
+HISTORY_MODE = os.getenv('HISTORY_MODE', 'changes')
+# Nombre maximum de points renvoyes par l'API historique en resolution 'auto'
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', '500'))
+# Maintenance : retention de l'historique brut et des agregats horaires (0 = illimite)
+RAW_HISTORY_RETENTION_DAYS = int(os.getenv('RAW_HISTORY_RETENTION_DAYS', '30'))
+HOURLY_ROLLUP_RETENTION_DAYS = int(os.getenv('HOURLY_ROLLUP_RETENTION_DAYS', '0'))
+MAINTENANCE_INTERVAL_HOURS = int(os.getenv('MAINTENANCE_INTERVAL_HOURS', '24'))
+MAINTENANCE_CHUNK_SIZE = int(os.getenv('MAINTENANCE_CHUNK_SIZE', '5000'))
+# SQLite : pool de lecture (handlers API), cache de pages et memoire mappee
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+DB_MMAP_SIZE_MB = int(os.getenv('DB_MMAP_SIZE_MB', '128'))
+# Cache des reponses API par generation de scan (nombre d'entrees, 0 = desactive)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+# Duree (secondes) pendant laquelle la generation lue dans scan_log est reutilisee
+RESPONSE_CACHE_GENERATION_TTL = float(os.getenv('RESPONSE_CACHE_GENERATION_TTL', '2'))
+# Compression des reponses API (gzip, ou brotli si installe) au-dela de ce seuil (octets)
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+# Pagination de /api/products : taille de page par defaut et maximum (parametre limit)
+PRODUCTS_PAGE_SIZE = int(os.getenv('PRODUCTS_PAGE_SIZE', '100'))
+PRODUCTS_MAX_LIMIT = int(os.getenv('PRODUCTS_MAX_LIMIT', '500'))
+# Parsing dans un pool de processus (0 = dans le thread de scan) et limite par page (secondes)
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '0'))
+PARSE_TIMEOUT = float(os.getenv('PARSE_TIMEOUT', '30'))
+# Pagination des listings : pages max par URL de recherche et pages recuperees en parallele
+LISTING_MAX_PAGES = int(os.getenv('LISTING_MAX_PAGES', '20'))
+LISTING_PAGE_WORKERS = int(os.getenv('LISTING_PAGE_WORKERS', '4'))
+# Surveillance des reassorts : intervalle (secondes, 0 = desactivee), taille de la
+# liste surveillee et fenetre (heures) d'un produit "recemment en rupture"
+RESTOCK_WATCH_INTERVAL = int(os.getenv('RESTOCK_WATCH_INTERVAL', '60'))
+RESTOCK_WATCH_SIZE = int(os.getenv('RESTOCK_WATCH_SIZE', '20'))
+RESTOCK_WATCH_HOURS = int(os.getenv('RESTOCK_WATCH_HOURS', '48'))
+# Bails multi-worker (leader du scheduler, scan en cours) : duree de validite
+# sans renouvellement (secondes) ; le detenteur renouvelle toutes les TTL/3
+LEASE_TTL = float(os.getenv('LEASE_TTL', '60'))
+# File de jobs de scan : attente entre deux consultations de la file (secondes)
+# et tentatives d'un job dont le worker a disparu avant de l'abandonner
+SCAN_QUEUE_POLL = float(os.getenv('SCAN_QUEUE_POLL', '0.5'))
+SCAN_JOB_MAX_ATTEMPTS = int(os.getenv('SCAN_JOB_MAX_ATTEMPTS', '3'))
+# Duree maximale d'un scan : au-dela, les jobs restants sont abandonnes et le
+# bail 'scan' libere (minutes)
+SCAN_TIMEOUT_MINUTES = float(os.getenv('SCAN_TIMEOUT_MINUTES', '60'))
+# SSE : connexions simultanees max et evenements conserves pour la reprise (Last-Event-ID)
+SSE_MAX_CLIENTS = int(os.getenv('SSE_MAX_CLIENTS', '500'))
+SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', '256'))
+# Parsing rapide (lxml + arbre limite a la grille produits) : 'all', liste de slugs, ou vide
+FAST_PARSER_SITES = os.getenv('FAST_PARSER_SITES', 'all')
 
 USER_AGENT = (
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
@@ -54,55 +143,239 @@ last_scan_info = {
     'sites_total': 0,
 }
 scan_lock = threading.Lock()
+# Scans par site (scan adaptatif) : sites en cours dans ce worker, sites dont
+# le job est tombe pendant un scan complet (scannes des qu'il se termine) et
+# dernier resultat de chaque site
+_site_scans_running = set()
+_pending_scan_sites = set()
+_site_runs = {}
 
 # SSE (Server-Sent Events) - Mises a jour temps reel
-_sse_clients = []
-_sse_lock = threading.Lock()
+# Un seul tampon circulaire d'evenements numerotes, partage par tous les
+# clients : chacun le lit a son rythme depuis son curseur (dernier id recu).
+# Diffuser un evenement ne coute qu'un ajout au tampon et un reveil des
+# lecteurs, quel que soit le nombre de clients. Les ids sont prefixes par une
+# epoque propre au processus : un id d'un autre worker ou d'avant un
+# redemarrage n'est pas rejoue.
+_sse_epoch = uuid.uuid4().hex[:8]
+_sse_events = deque(maxlen=SSE_BUFFER_SIZE)  # (seq, trame SSE, type)
+_sse_state = {'seq': 0, 'evicted': 0, 'clients': 0}
+_sse_cond = threading.Condition()
 
 
 def broadcast_event(event_type, data):
-    """Envoie un evenement SSE a tous les clients connectes."""
-    with _sse_lock:
-        dead = []
-        for q in _sse_clients:
-            try:
-                q.put_nowait({'event': event_type, 'data': data})
-            except queue.Full:
-                dead.append(q)
-        for q in dead:
-            _sse_clients.remove(q)
+    """Ajoute un evenement SSE au tampon et reveille les clients connectes.
+
+    La trame est serialisee une seule fois. Des 'scan:progress' consecutifs
+    sont fusionnes : le nouveau remplace le precedent (progression cumulee),
+    qu'un client en retard ne recoit donc qu'une fois.
+    """
+    with _sse_cond:
+        _sse_state['seq'] += 1
+        seq = _sse_state['seq']
+        frame = f"id: {_sse_epoch}-{seq}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+        if event_type == 'scan:progress' and _sse_events and _sse_events[-1][2] == event_type:
+            _sse_events.pop()
+        elif len(_sse_events) == _sse_events.maxlen:
+            _sse_state['evicted'] = _sse_events[0][0]
+        _sse_events.append((seq, frame, event_type))
+        _sse_cond.notify_all()
+
+
+def sse_cursor(last_event_id):
+    """Curseur de reprise d'un id Last-Event-ID, ou None s'il n'est pas rejouable."""
+    epoch, _, seq = (last_event_id or '').partition('-')
+    if epoch != _sse_epoch or not seq.isdigit():
+        return None
+    seq = int(seq)
+    with _sse_cond:
+        # Evenements manquants sortis du tampon, ou id inconnu
+        if seq < _sse_state['evicted'] or seq > _sse_state['seq']:
+            return None
+    return seq
+
+
+def sse_events_after(cursor, timeout):
+    """Trames posterieures a `cursor` (attente au plus `timeout` s).
+
+    Retourne (trames, nouveau curseur, perte) ; `perte` indique qu'un client
+    trop lent a laisse sortir du tampon des evenements qu'il n'avait pas lus.
+    """
+    with _sse_cond:
+        if _sse_state['seq'] <= cursor:
+            _sse_cond.wait(timeout)
+        frames = []
+        for seq, frame, _ in reversed(_sse_events):
+            if seq <= cursor:
+                break
+            frames.append(frame)
+        return frames[::-1], _sse_state['seq'], cursor < _sse_state['evicted']
+
+
+def sse_stats():
+    """Clients SSE connectes et etat du tampon d'evenements."""
+    with _sse_cond:
+        return {
+            'clients': _sse_state['clients'],
+            'last_event_id': f"{_sse_epoch}-{_sse_state['seq']}",
+            'buffered': len(_sse_events),
+        }
 
 
 # ============================================================
 # BASE DE DONNEES
 # ============================================================
 
+def configure_connection(conn, read_only=False):
+    """Applique les pragmas de performance a une connexion SQLite."""
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    # En WAL, synchronous=NORMAL reste sur (pas de corruption) et evite un fsync par commit
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE_MB * 1024 * 1024}")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def open_db(read_only=False):
+    """Ouvre une connexion configuree, utilisable depuis n'importe quel thread."""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    return configure_connection(conn, read_only)
+
+
+# Pool de connexions en lecture seule (handlers API) et connexion d'ecriture unique
+# (scanner, maintenance). En WAL les lectures ne bloquent pas sur l'ecrivain.
+_read_pool = queue.LifoQueue()
+_read_pool_lock = threading.Lock()
+_writer_lock = threading.RLock()
+_writer_conn = None
+_db_stats = {
+    'read_created': 0, 'read_acquired': 0, 'read_waited': 0,
+    'read_wait_ms_total': 0.0, 'read_wait_ms_max': 0.0,
+    'write_acquired': 0, 'write_wait_ms_total': 0.0, 'write_wait_ms_max': 0.0,
+}
+
+
+def _record_wait(kind, wait_ms):
+    with _read_pool_lock:
+        _db_stats[f'{kind}_acquired'] += 1
+        _db_stats[f'{kind}_wait_ms_total'] += wait_ms
+        _db_stats[f'{kind}_wait_ms_max'] = max(_db_stats[f'{kind}_wait_ms_max'], wait_ms)
+
+
+def acquire_read_db():
+    """Emprunte une connexion de lecture au pool (creee a la demande, DB_READ_POOL_SIZE max)."""
+    started = time.perf_counter()
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        conn = None
+        with _read_pool_lock:
+            if _db_stats['read_created'] < DB_READ_POOL_SIZE:
+                _db_stats['read_created'] += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                conn = open_db(read_only=True)
+            except sqlite3.Error:
+                with _read_pool_lock:
+                    _db_stats['read_created'] -= 1
+                raise
+        else:
+            with _read_pool_lock:
+                _db_stats['read_waited'] += 1
+            try:
+                conn = _read_pool.get(timeout=DB_POOL_TIMEOUT)
+            except queue.Empty:
+                raise sqlite3.OperationalError("pool de connexions SQLite sature")
+    _record_wait('read', (time.perf_counter() - started) * 1000)
+    return conn
+
+
+def release_read_db(conn):
+    """Rend une connexion de lecture au pool."""
+    try:
+        conn.rollback()
+    except sqlite3.Error:
+        # Connexion inutilisable : la fermer et liberer sa place dans le pool
+        conn.close()
+        with _read_pool_lock:
+            _db_stats['read_created'] -= 1
+        return
+    _read_pool.put(conn)
+
+
+@contextmanager
+def writer_db():
+    """Connexion d'ecriture unique, serialisee entre scanner et maintenance.
+
+    Le verrou est reentrant : une fonction tenant deja l'ecrivain peut en
+    appeler une autre qui le demande a son tour.
+    """
+    global _writer_conn
+    started = time.perf_counter()
+    with _writer_lock:
+        _record_wait('write', (time.perf_counter() - started) * 1000)
+        if _writer_conn is None:
+            _writer_conn = open_db()
+        yield _writer_conn
+
+
+def db_pool_stats():
+    """Statistiques du pool de lecture et de la connexion d'ecriture."""
+    stats = {
+        'read_pool_size': DB_READ_POOL_SIZE,
+        'read_connections': _db_stats['read_created'],
+        'read_idle': _read_pool.qsize(),
+        'read_acquired': _db_stats['read_acquired'],
+        'read_waited': _db_stats['read_waited'],
+        'write_acquired': _db_stats['write_acquired'],
+    }
+    for kind in ('read', 'write'):
+        acquired = _db_stats[f'{kind}_acquired']
+        stats[f'{kind}_wait_ms_avg'] = round(_db_stats[f'{kind}_wait_ms_total'] / acquired, 2) if acquired else 0
+        stats[f'{kind}_wait_ms_max'] = round(_db_stats[f'{kind}_wait_ms_max'], 2)
+    return stats
+
+
 def get_db():
-    """Connexion a la base de donnees avec reutilisation par requete."""
+    """Connexion de lecture empruntee au pool pour la duree de la requete."""
     if 'db' not in g:
-        g.db = sqlite3.connect(DB_PATH)
-        g.db.row_factory = sqlite3.Row
+        g.db = acquire_read_db()
     return g.db
 
 
 @app.teardown_appcontext
 def close_db(exception):
-    """Ferme la connexion a la fin de la requete."""
+    """Rend la connexion au pool a la fin de la requete."""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        release_read_db(db)
 
 
-def get_standalone_db():
-    """Connexion standalone hors contexte Flask (scheduler)."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Recherche plein texte disponible (products_fts cree par migrate_db)
+PRODUCTS_FTS_ENABLED = False
+
+
+# Tables d'agregats de l'historique : (table, format du debut de periode)
+ROLLUP_TABLES = (
+    ('price_rollup_hourly', '%Y-%m-%d %H:00:00'),
+    ('price_rollup_daily', '%Y-%m-%d 00:00:00'),
+)
 
 
 def migrate_db():
-    """Migrations legeres au demarrage (ajout de colonnes)."""
-    conn = sqlite3.connect(DB_PATH)
+    """Migrations legeres au demarrage (ajout de colonnes et de tables).
+
+    Executee a l'import par chaque worker gunicorn : les remplissages initiaux
+    se font sous verrou d'ecriture (BEGIN IMMEDIATE) et sont idempotents.
+    """
+    # Attente genereuse : un autre worker peut etre en train de remplir les tables
+    conn = sqlite3.connect(DB_PATH, timeout=max(60, DB_BUSY_TIMEOUT_MS / 1000))
     cursor = conn.cursor()
     # Ajouter colonne preorder si absente
     cols = [row[1] for row in cursor.execute("PRAGMA table_info(price_history)").fetchall()]
@@ -110,17 +383,530 @@ def migrate_db():
         cursor.execute("ALTER TABLE price_history ADD COLUMN preorder INTEGER DEFAULT 0")
         conn.commit()
         logger.info("Migration: colonne 'preorder' ajoutee a price_history")
+    if 'last_confirmed_at' not in cols:
+        cursor.execute("ALTER TABLE price_history ADD COLUMN last_confirmed_at TIMESTAMP")
+        conn.commit()
+        logger.info("Migration: colonne 'last_confirmed_at' ajoutee a price_history")
+    # File de jobs de scan (un job par site et par scan)
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scan_id INTEGER NOT NULL,
+            site_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            heartbeat_at REAL,
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (scan_id) REFERENCES scan_log(id),
+            FOREIGN KEY (site_id) REFERENCES sites(id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_scan_jobs_status ON scan_jobs(status, id);
+        CREATE INDEX IF NOT EXISTS idx_scan_jobs_scan ON scan_jobs(scan_id);
+    """)
+    # Scans par site (scan adaptatif) : site_id renseigne, NULL pour un scan complet
+    cols = [row[1] for row in cursor.execute("PRAGMA table_info(scan_log)").fetchall()]
+    if 'site_id' not in cols:
+        cursor.execute("ALTER TABLE scan_log ADD COLUMN site_id INTEGER REFERENCES sites(id)")
+        conn.commit()
+        logger.info("Migration: colonne 'site_id' ajoutee a scan_log")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_log_site ON scan_log(site_id, id)")
+    # Bails partages entre workers (leader du scheduler, scan en cours)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    # Compteur des modifications de la table products (ajout, suppression,
+    # nom, image, set) : fait partie de la version des donnees (data_version)
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS data_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            products INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO data_changes (id) VALUES (1);
+        CREATE TRIGGER IF NOT EXISTS products_changed_insert AFTER INSERT ON products BEGIN
+            UPDATE data_changes SET products = products + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_changed_delete AFTER DELETE ON products BEGIN
+            UPDATE data_changes SET products = products + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_changed_update
+        AFTER UPDATE OF name, set_code, image_url ON products
+        WHEN old.name IS NOT new.name OR old.set_code IS NOT new.set_code
+          OR old.image_url IS NOT new.image_url BEGIN
+            UPDATE data_changes SET products = products + 1;
+        END;
+    """)
+    # Cache des validateurs HTTP (ETag / Last-Modified) par page de listing
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS url_cache (
+            url TEXT PRIMARY KEY,
+            site_id INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            products TEXT,
+            pages TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (site_id) REFERENCES sites(id)
+        )
+    """)
+    cols = [row[1] for row in cursor.execute("PRAGMA table_info(url_cache)").fetchall()]
+    if 'content_hash' not in cols:
+        cursor.execute("ALTER TABLE url_cache ADD COLUMN content_hash TEXT")
+        logger.info("Migration: colonne 'content_hash' ajoutee a url_cache")
+    if 'pages' not in cols:
+        cursor.execute("ALTER TABLE url_cache ADD COLUMN pages TEXT")
+        logger.info("Migration: colonne 'pages' ajoutee a url_cache")
+    # Etat courant denormalise (dernier releve de prix par produit)
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS product_latest (
+            product_id INTEGER PRIMARY KEY,
+            history_id INTEGER,
+            price REAL,
+            in_stock INTEGER DEFAULT 0,
+            preorder INTEGER DEFAULT 0,
+            checked_at TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products(id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_latest_stock ON product_latest(in_stock, price);
+    """)
+    # Remplissages initiaux dans une seule transaction d'ecriture : un worker
+    # demarrant en meme temps attend le commit puis voit les tables remplies
+    cursor.execute("BEGIN IMMEDIATE")
+    backfilled = cursor.execute("""
+        INSERT INTO product_latest (product_id, history_id, price, in_stock, preorder, checked_at)
+        SELECT p.id, ph.id, ph.price, ph.in_stock, ph.preorder, ph.checked_at
+        FROM products p
+        JOIN price_history ph ON ph.id = (
+            SELECT id FROM price_history
+            WHERE product_id = p.id ORDER BY checked_at DESC LIMIT 1
+        )
+        WHERE NOT EXISTS (SELECT 1 FROM product_latest WHERE product_id = p.id)
+    """).rowcount
+    if backfilled > 0:
+        logger.info(f"Migration: {backfilled} produit(s) ajoute(s) a product_latest")
+    # Agregats horaires et journaliers de l'historique des prix
+    for table, bucket_fmt in ROLLUP_TABLES:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                product_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                min_price REAL,
+                max_price REAL,
+                last_price REAL,
+                samples INTEGER DEFAULT 0,
+                in_stock_samples INTEGER DEFAULT 0,
+                last_at TIMESTAMP,
+                PRIMARY KEY (product_id, bucket)
+            ) WITHOUT ROWID
+        """)
+        if not exists:
+            # Premier demarrage : construire les agregats depuis l'historique brut
+            rolled = cursor.execute(f"""
+                INSERT OR IGNORE INTO {table} (product_id, bucket, min_price, max_price, last_price,
+                                     samples, in_stock_samples, last_at)
+                SELECT g.product_id, g.bucket, g.min_price, g.max_price,
+                       (SELECT price FROM price_history
+                        WHERE product_id = g.product_id AND checked_at <= g.last_at
+                        ORDER BY checked_at DESC, id DESC LIMIT 1),
+                       g.samples, g.in_stock_samples, g.last_at
+                FROM (
+                    SELECT product_id, strftime('{bucket_fmt}', checked_at) AS bucket,
+                           MIN(price) AS min_price, MAX(price) AS max_price,
+                           COUNT(*) AS samples, SUM(in_stock) AS in_stock_samples,
+                           MAX(checked_at) AS last_at
+                    FROM price_history GROUP BY product_id, bucket
+                ) g
+            """).rowcount
+            logger.info(f"Migration: table {table} creee ({rolled} agregat(s))")
+    conn.commit()
+
+    # Index plein texte des noms de produits (FTS5, insensible aux accents),
+    # synchronise par triggers sur products (y compris l'upsert du scanner)
+    global PRODUCTS_FTS_ENABLED
+    fts_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+    ).fetchone()
+    try:
+        cursor.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, content='products', content_rowid='id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products
+            WHEN old.name IS NOT new.name BEGIN
+                INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+            END;
+        """)
+        if not fts_exists:
+            cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+            conn.commit()
+            logger.info("Migration: index plein texte products_fts cree")
+        PRODUCTS_FTS_ENABLED = True
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 indisponible, recherche par LIKE: {e}")
+
+    # Auto-vacuum incremental (requis par la maintenance) : conversion unique
+    if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        try:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+            logger.info("Migration: auto_vacuum incremental active")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Migration auto_vacuum reportee: {e}")
+
+    # Journal WAL (persistant) : les lectures de l'API ne bloquent plus pendant un scan
+    if cursor.execute("PRAGMA journal_mode").fetchone()[0] != 'wal':
+        mode = cursor.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        logger.info(f"Migration: journal_mode = {mode}")
     conn.close()
 
 
-if DB_PATH.exists():
+# Processus de parsing (pool 'spawn') : ce module y est reimporte, sans
+# migration ni scheduler
+IN_PARSE_WORKER = multiprocessing.parent_process() is not None
+# Mode worker de scan (`python app.py worker`) : ni scheduler ni API
+RUN_AS_WORKER = __name__ == '__main__' and sys.argv[1:2] == ['worker']
+
+if DB_PATH.exists() and not IN_PARSE_WORKER:
     migrate_db()
 
 
+# ============================================================
+# BAILS (COORDINATION MULTI-WORKER)
+# ============================================================
+
+# Un bail est un verrou nomme avec date d'expiration, stocke dans la table
+# leases et donc partage par tous les workers gunicorn : 'scheduler' designe
+# le worker qui execute les jobs planifies, 'scan' celui qui scanne. Le
+# detenteur le renouvelle (heartbeat) ; s'il meurt, le bail expire apres
+# LEASE_TTL secondes et un autre worker peut le prendre.
+_worker_token = uuid.uuid4().hex[:8]
+
+
+def worker_id():
+    """Identifiant de ce worker (le pid distingue les workers forkes)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_worker_token}"
+
+
+def acquire_lease(name):
+    """Prend le bail `name` s'il est libre, expire ou deja detenu (renouvellement).
+
+    Une seule requete d'upsert conditionnel : deux workers concurrents ne
+    peuvent pas obtenir le meme bail. Retourne True si le bail est a nous.
+    """
+    holder = worker_id()
+    now = time.time()
+    with writer_db() as conn:
+        with conn:
+            conn.execute(
+                """INSERT INTO leases (name, holder, acquired_at, expires_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET
+                       acquired_at = CASE WHEN leases.holder = excluded.holder
+                                          THEN leases.acquired_at ELSE excluded.acquired_at END,
+                       holder = excluded.holder,
+                       expires_at = excluded.expires_at
+                   WHERE leases.holder = excluded.holder OR leases.expires_at < ?""",
+                (name, holder, now, now + LEASE_TTL, now)
+            )
+            row = conn.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+    return row['holder'] == holder
+
+
+def renew_lease(name):
+    """Prolonge le bail `name` s'il est toujours a nous ; False s'il a ete perdu."""
+    with writer_db() as conn:
+        with conn:
+            return conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND holder = ?",
+                (time.time() + LEASE_TTL, name, worker_id())
+            ).rowcount == 1
+
+
+def release_lease(name):
+    """Libere le bail `name` s'il est a nous."""
+    with writer_db() as conn:
+        with conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, worker_id()))
+
+
+def active_lease(conn, name):
+    """Detenteur et expiration du bail `name` s'il est en cours de validite, sinon None."""
+    return conn.execute(
+        "SELECT holder, acquired_at, expires_at FROM leases WHERE name = ? AND expires_at >= ?",
+        (name, time.time())
+    ).fetchone()
+
+
+def active_site_leases(conn):
+    """Bails 'scan:<slug>' en cours de validite (scans par site, tous workers)."""
+    return conn.execute(
+        "SELECT name, holder, expires_at FROM leases WHERE name LIKE 'scan:%' AND expires_at >= ?",
+        (time.time(),)
+    ).fetchall()
+
+
+def start_heartbeat(label, renew, release=None, on_lost=None):
+    """Appelle `renew` toutes les LEASE_TTL/3 secondes dans un thread.
+
+    Le heartbeat s'arrete si `renew` retourne False (bail ou job perdu), ou
+    si aucun renouvellement n'a abouti depuis LEASE_TTL secondes (base
+    indisponible : le bail a expire) ; `on_lost` est alors appele pour que le
+    travail protege s'interrompe. Retourne une fonction qui arrete le
+    heartbeat puis appelle `release`.
+    """
+    stop = threading.Event()
+
+    def beat():
+        renewed_at = time.monotonic()
+        while not stop.wait(LEASE_TTL / 3):
+            try:
+                lost = not renew()
+                if not lost:
+                    renewed_at = time.monotonic()
+            except sqlite3.Error as e:
+                logger.warning(f"Heartbeat {label} impossible: {e}")
+                lost = time.monotonic() - renewed_at >= LEASE_TTL
+            if lost:
+                logger.error(f"{label} perdu (expire ou repris par un autre worker)")
+                if on_lost:
+                    on_lost()
+                return
+
+    thread = threading.Thread(target=beat, daemon=True, name=f'heartbeat-{label}')
+    thread.start()
+
+    def stop_heartbeat():
+        stop.set()
+        thread.join()
+        if release:
+            try:
+                release()
+            except sqlite3.Error as e:
+                logger.warning(f"Liberation {label} impossible: {e}")
+
+    return stop_heartbeat
+
+
+def close_interrupted_scans(conn):
+    """Cloture les scans restes ouverts (finished_at NULL) dans scan_log.
+
+    A appeler quand personne ne detient le bail 'scan' (ou quand on vient de
+    le prendre) : un tel scan vient d'un coordinateur mort en plein scan. Un
+    scan par site n'est cloture que si son bail 'scan:<slug>' a expire. Les
+    jobs en attente sont annules et les resultats deja obtenus conserves.
+    """
+    open_scans = [
+        row['id'] for row in conn.execute(
+            "SELECT l.id, s.slug FROM scan_log l LEFT JOIN sites s ON s.id = l.site_id "
+            "WHERE l.finished_at IS NULL"
+        )
+        if row['slug'] is None or active_lease(conn, f"scan:{row['slug']}") is None
+    ]
+    for scan_id in open_scans:
+        conn.execute(
+            "UPDATE scan_jobs SET status = 'failed', result = ?, finished_at = CURRENT_TIMESTAMP "
+            "WHERE scan_id = ? AND status = 'pending'",
+            (json.dumps({'status': 'cancelled', 'count': 0}), scan_id)
+        )
+        conn.execute(
+            "UPDATE scan_log SET finished_at = ?, results = ? WHERE id = ?",
+            (datetime.now().isoformat(), json.dumps(scan_job_results(conn, scan_id)), scan_id)
+        )
+    if open_scans:
+        logger.warning(f"{len(open_scans)} scan(s) interrompu(s) cloture(s) dans scan_log")
+    return len(open_scans)
+
+
 # ============================================================
 # UTILITAIRES SCRAPING
 # ============================================================
 
+# Politesse par hote : chaque domaine a son propre semaphore (requetes
+# simultanees) et sa propre date de prochaine requete autorisee.
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+@contextmanager
+def host_slot(url):
+    """Reserve un creneau de requete pour l'hote de l'URL (limites par hote)."""
+    host = urlparse(url).netloc.lower()
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = {
+                'semaphore': threading.BoundedSemaphore(max(1, HOST_MAX_CONCURRENCY)),
+                'lock': threading.Lock(),
+                'next_at': 0.0,
+            }
+            _host_slots[host] = slot
+
+    with slot['semaphore']:
+        # Reserver la date de depart sous verrou, attendre hors verrou
+        with slot['lock']:
+            now = time.monotonic()
+            start_at = max(now, slot['next_at'])
+            slot['next_at'] = start_at + HOST_MIN_INTERVAL
+        if start_at > now:
+            time.sleep(start_at - now)
+        yield
+
+
+class NotModified(Exception):
+    """La page de recherche n'a pas change depuis le dernier scan (HTTP 304)."""
+
+
+class ContentUnchanged(NotModified):
+    """Reponse 200 identique octet pour octet a celle du scan precedent."""
+
+
+# GET conditionnel : le scanner ouvre un contexte par page de listing (URL de
+# recherche puis chaque page de pagination) et la premiere requete faite dans
+# ce contexte porte les validateurs du scan precedent. Les requetes suivantes
+# (API, fiches produit) ne sont pas concernees.
+_fetch_context = threading.local()
+
+
+@contextmanager
+def conditional_fetch(cached=None):
+    """Active le GET conditionnel pour la premiere requete du bloc.
+
+    Produit un dict mis a jour avec le statut, les nouveaux validateurs et
+    l'empreinte du corps de la reponse ; `NotModified` est levee si le
+    serveur repond 304, `ContentUnchanged` si le corps est identique.
+    """
+    state = {
+        'pending': True,
+        'status': None,
+        'etag': cached['etag'] if cached else None,
+        'last_modified': cached['last_modified'] if cached else None,
+        'content_hash': cached['content_hash'] if cached else None,
+        # Pages suivantes du listing, renseignees par le scraper
+        'pages': [],
+        # Octets recus par toutes les requetes du bloc
+        'bytes': 0,
+        # Derniere erreur reseau/HTTP d'une requete du bloc (retries epuises)
+        'error': None,
+    }
+    _fetch_context.conditional = state
+    try:
+        yield state
+    finally:
+        _fetch_context.conditional = None
+
+
+def record_fetch_error(error):
+    """Note l'echec d'une requete dans le contexte de GET conditionnel.
+
+    fetch_page et fetch_json renvoient None en cas d'erreur : sans cette
+    trace, une page injoignable passerait pour une page vide.
+    """
+    state = getattr(_fetch_context, 'conditional', None)
+    if state is not None:
+        state['error'] = str(error)
+
+
+# Client HTTP partage par tous les scrapers : une session keep-alive avec un
+# pool de connexions par hote (HTTP_POOL_HOSTS hotes, HTTP_POOL_SIZE
+# connexions chacun) et une politique de retry sur les erreurs transitoires.
+http_session = http_requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=HTTP_POOL_HOSTS,
+    pool_maxsize=HTTP_POOL_SIZE,
+    max_retries=Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    ),
+)
+http_session.mount('https://', _http_adapter)
+http_session.mount('http://', _http_adapter)
+
+
+def http_get(url, headers):
+    """GET via le client partage, en respectant les limites de l'hote."""
+    state = getattr(_fetch_context, 'conditional', None)
+    if not state or not state['pending']:
+        with host_slot(url):
+            response = http_session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if state:
+            state['bytes'] += len(response.content)
+        return response
+
+    state['pending'] = False
+    headers = dict(headers)
+    if state['etag']:
+        headers['If-None-Match'] = state['etag']
+    if state['last_modified']:
+        headers['If-Modified-Since'] = state['last_modified']
+
+    with host_slot(url):
+        response = http_session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+    state['status'] = response.status_code
+    state['bytes'] += len(response.content)
+    if response.status_code == 304:
+        raise NotModified(url)
+    if response.status_code != 200:
+        return response
+
+    state['etag'] = response.headers.get('ETag')
+    state['last_modified'] = response.headers.get('Last-Modified')
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if content_hash == state['content_hash']:
+        raise ContentUnchanged(url)
+    state['content_hash'] = content_hash
+    return response
+
+
+def http_pool_stats():
+    """Compteurs des pools de connexions : requetes, handshakes et reutilisations.
+
+    `connections` compte les connexions TCP(+TLS) ouvertes ; toute requete
+    au-dela est servie par une connexion keep-alive reutilisee.
+    """
+    hosts = {}
+    pools = _http_adapter.poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        host = hosts.setdefault(pool.host, {'requests': 0, 'connections': 0})
+        host['requests'] += pool.num_requests
+        host['connections'] += pool.num_connections
+
+    for host in hosts.values():
+        host['reused'] = max(0, host['requests'] - host['connections'])
+
+    return {
+        'requests': sum(h['requests'] for h in hosts.values()),
+        'connections': sum(h['connections'] for h in hosts.values()),
+        'reused': sum(h['reused'] for h in hosts.values()),
+        'hosts': hosts,
+    }
+
+
 def fetch_page(url):
     """Recupere le contenu HTML d'une page."""
     headers = {
@@ -129,57 +915,44 @@ def fetch_page(url):
         'Accept-Language': 'fr-FR,fr;q=0.9,en;q=0.5',
     }
     try:
-        response = http_requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        response = http_get(url, headers)
         response.raise_for_status()
         return response.text
     except http_requests.RequestException as e:
         logger.error(f"Erreur requete {url}: {e}")
+        record_fetch_error(e)
         return None
 
 
-def detect_set_code(name):
-    """Detecte le code du set One Piece (OP01, EB01, ST01...) dans le nom du produit."""
-    match = re.search(r'(?:OP|op)[-\s]?(\d{2})', name)
-    if match:
-        return f"OP{match.group(1)}"
-    match = re.search(r'(?:EB|eb)[-\s]?(\d{2})', name)
-    if match:
-        return f"EB{match.group(1)}"
-    match = re.search(r'(?:ST|st)[-\s]?(\d{2})', name)
-    if match:
-        return f"ST{match.group(1)}"
-    match = re.search(r'(?:PRB|prb)[-\s]?(\d{2})', name)
-    if match:
-        return f"PRB{match.group(1)}"
-    set_names = {
-        'romance dawn': 'OP01',
-        'paramount war': 'OP02',
-        'pillars of strength': 'OP03',
-        'kingdoms of intrigue': 'OP04',
-        'awakening of the new era': 'OP05',
-        'wings of the captain': 'OP06',
-        '500 years in the future': 'OP07',
-        'two legends': 'OP08',
-        'the four emperors': 'OP09',
-        'quatre empereurs': 'OP09',
-        'royal blood': 'OP10',
-        'sang royal': 'OP10',
-        'swift as lightning': 'OP11',
-        'poings vifs': 'OP11',
-        'carrying on his will': 'OP12',
-        'heritage du maitre': 'OP12',
-        'h\u00e9ritage du ma\u00eetre': 'OP12',
-        'successeurs': 'OP13',
-        'azure sea': 'OP14',
-        'sept de la mer': 'OP14',
-        'heroines edition': 'EB03',
-    }
-    name_lower = name.lower()
-    for set_name, code in set_names.items():
-        if set_name in name_lower:
-            return code
-    return None
+# Noms de sets reconnus dans les intitules produits (en minuscules). En cas de
+# plusieurs correspondances, le premier nom de ce dictionnaire l'emporte.
+SET_NAME_CODES = {
+    'romance dawn': 'OP01',
+    'paramount war': 'OP02',
+    'pillars of strength': 'OP03',
+    'kingdoms of intrigue': 'OP04',
+    'awakening of the new era': 'OP05',
+    'wings of the captain': 'OP06',
+    '500 years in the future': 'OP07',
+    'two legends': 'OP08',
+    'the four emperors': 'OP09',
+    'quatre empereurs': 'OP09',
+    'royal blood': 'OP10',
+    'sang royal': 'OP10',
+    'swift as lightning': 'OP11',
+    'poings vifs': 'OP11',
+    'carrying on his will': 'OP12',
+    'heritage du maitre': 'OP12',
+    'h\u00e9ritage du ma\u00eetre': 'OP12',
+    'successeurs': 'OP13',
+    'azure sea': 'OP14',
+    'sept de la mer': 'OP14',
+    'heroines edition': 'EB03',
+}
 
+# Prefixes de codes de set, par priorite decroissante (un code OP l'emporte
+# sur un code EB present dans le meme nom, etc.)
+SET_CODE_PREFIXES = ('OP', 'EB', 'ST', 'PRB')
 
 # Sets qui n'existent PAS en francais (sortie FR a partir de OP09, EB02, PRB02)
 NON_FR_SETS = {'OP01', 'OP02', 'OP03', 'OP04', 'OP05', 'OP06', 'OP07', 'OP08',
@@ -187,32 +960,105 @@ NON_FR_SETS = {'OP01', 'OP02', 'OP03', 'OP04', 'OP05', 'OP06', 'OP07', 'OP08',
                'ST07', 'ST08', 'ST09', 'ST10', 'ST11', 'ST12', 'ST13'}
 
 
+def trie_pattern(words):
+    """Alternative regex factorisee par prefixes communs (trie).
+
+    Le moteur ne teste qu'une branche par caractere : ajouter un mot ne
+    rallonge pas le travail fait a chaque position du nom.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{pattern})?' if '' in node else pattern
+
+    return build(trie)
+
+
+def build_name_classifier():
+    """Regex unique classant un nom de produit en une passe.
+
+    Chaque alternative est un groupe nomme (code de set par prefixe, nom de
+    set, mention display, langue etrangere, lot/case) : finditer renvoie
+    toutes les occurrences en un seul parcours du nom. Les motifs ne se
+    chevauchent pas (aucun nom de set ne contient de code), une occurrence
+    ne peut donc pas en masquer une autre.
+    """
+    alternatives = [
+        # Codes sensibles a la casse : 'OP12' / 'op-12' mais pas 'Op12'
+        f"(?P<code{i}>(?:{prefix}|{prefix.lower()})[-\\s]?\\d{{2}})"
+        for i, prefix in enumerate(SET_CODE_PREFIXES)
+    ]
+    alternatives += [
+        f"(?P<set_name>(?i:{trie_pattern(SET_NAME_CODES)}))",
+        "(?P<display>(?i:display|boite de 2[04]))",
+        # Note : eviter '- en' et ' en ' qui matchent le francais "en francais" ;
+        # les codes langue ne sont exclus qu'en suffixe (ex: "Display OP10 - JPN")
+        "(?P<foreign>(?i:\\((?:en|eng|jap|jpn)\\)|english|japanese|japonais|anglais"
+        "|[-\\s](?:en|eng|jap|jpn)\\s*$))",
+        # Cases/cartons de displays, bundles et double packs
+        "(?P<bundle>(?i:case de|case -|carton de|carton -|bundle| \\+ |double pack))",
+    ]
+    return re.compile('|'.join(alternatives))
+
+
+NAME_CLASSIFIER = build_name_classifier()
+SET_NAME_RANK = {set_name: rank for rank, set_name in enumerate(SET_NAME_CODES)}
+
+
+@lru_cache(maxsize=8192)
+def classify_name(name):
+    """Classe un nom de produit en une passe (resultat memorise par nom).
+
+    Retourne (set_code, display, foreign, bundle) : code du set detecte (ou
+    None), mention display / boite de 20-24, langue non francaise, lot ou case.
+    Priorite des codes : OP > EB > ST > PRB (premiere occurrence), puis les
+    noms de sets dans l'ordre de SET_NAME_CODES.
+    """
+    best = None
+    flags = {'display': False, 'foreign': False, 'bundle': False}
+    for match in NAME_CLASSIFIER.finditer(name):
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind in flags:
+            flags[kind] = True
+            continue
+        if kind == 'set_name':
+            key = text.lower()
+            candidate = (len(SET_CODE_PREFIXES) + SET_NAME_RANK[key], SET_NAME_CODES[key])
+        else:
+            rank = int(kind[len('code'):])
+            candidate = (rank, SET_CODE_PREFIXES[rank] + text[-2:])
+        # A rang egal, la premiere occurrence (finditer va de gauche a droite) l'emporte
+        if best is None or candidate[0] < best[0]:
+            best = candidate
+    set_code = best[1] if best else None
+    return set_code, flags['display'], flags['foreign'], flags['bundle']
+
+
+def detect_set_code(name):
+    """Detecte le code du set One Piece (OP01, EB01, ST01...) dans le nom du produit."""
+    return classify_name(name)[0]
+
+
 def is_french_display(name):
     """Verifie si le produit est un display unique en francais (pas case, pas bundle)."""
-    name_lower = name.lower()
-    if 'display' not in name_lower and 'boite de 24' not in name_lower and 'boite de 20' not in name_lower:
+    set_code, display, foreign, bundle = classify_name(name)
+    if not display:
         return False
     # Exclure les sets qui n'existent pas en francais
-    set_code = detect_set_code(name)
-    if set_code and set_code in NON_FR_SETS:
-        return False
-    # Exclure les langues non-francaises
-    # Note : eviter '- en' et ' en ' qui matchent le francais "en francais"
-    lang_excluded = ['(en)', '(eng)', '(jap)', '(jpn)',
-                     'english', 'japanese', 'japonais', 'anglais']
-    for ex in lang_excluded:
-        if ex in name_lower:
-            return False
-    # Codes langue en suffixe (ex: "Display OP10 - JPN", "Display OP10 - EN")
-    if re.search(r'[-\s](en|eng|jap|jpn)\s*$', name_lower):
-        return False
-    # Exclure les cases/cartons de displays (cartons de 10/12 displays)
-    if 'case de' in name_lower or 'case -' in name_lower or 'carton de' in name_lower or 'carton -' in name_lower:
+    if set_code in NON_FR_SETS:
         return False
-    # Exclure les bundles et double packs (pas des displays de boosters)
-    if 'bundle' in name_lower or ' + ' in name_lower or 'double pack' in name_lower:
-        return False
-    return True
+    # Exclure les langues non-francaises et les cases / bundles
+    return not foreign and not bundle
 
 
 def parse_price(price_text):
@@ -228,6 +1074,183 @@ def parse_price(price_text):
     return None
 
 
+# Backend de parsing rapide : lxml si installe (dependance optionnelle),
+# sinon html.parser. Dans les deux cas seul le sous-arbre de la grille
+# produits est construit (SoupStrainer), le reste de la page est ignore.
+FAST_PARSER_FEATURES = 'lxml' if builder_registry.lookup('lxml') else 'html.parser'
+
+
+def grid_strainer(*classes, tags=()):
+    """SoupStrainer ne gardant que les elements portant une des classes (ou balises)."""
+    wanted = frozenset(classes)
+
+    def match(name, attrs):
+        if name in tags:
+            return True
+        value = attrs.get('class') or ''
+        values = value.split() if isinstance(value, str) else value
+        return not wanted.isdisjoint(values)
+
+    return SoupStrainer(match)
+
+
+def use_fast_parser(site_slug):
+    """Indique si le backend rapide est active pour ce site (FAST_PARSER_SITES)."""
+    enabled = {s.strip() for s in FAST_PARSER_SITES.split(',') if s.strip()}
+    return 'all' in enabled or site_slug in enabled
+
+
+def make_soup(html, site_slug, strainer):
+    """Construit l'arbre HTML avec le backend choisi pour le site."""
+    if use_fast_parser(site_slug):
+        return BeautifulSoup(html, FAST_PARSER_FEATURES, parse_only=strainer)
+    return BeautifulSoup(html, 'html.parser')
+
+
+# Sous-arbres utiles par scraper (les selecteurs CSS restent ceux du parsing complet)
+DESTOCKTCG_GRID = grid_strainer('product-item-list')
+WOOCOMMERCE_GRID = grid_strainer('products', 'product', 'product-item', 'type-product')
+COINDESBARONS_GRID = grid_strainer('card-game')
+PHILIBERT_GRID = grid_strainer('ajax_block_product', tags=('script',))
+ULTRAJEUX_GRID = grid_strainer('block_produit')
+ANTRETEMPS_GRID = grid_strainer('product_box')
+CARDSHUNTER_GRID = grid_strainer('jet-listing-grid__items')
+
+
+# Pagination : parametres de numero de page reconnus dans les liens
+# (?p=2 PrestaShop, ?page=2, ?paged=2) et chemins WordPress (/page/2/)
+PAGE_PARAMS = ('p', 'page', 'paged', 'pg')
+_PAGE_PATH_RE = re.compile(r'/page/(\d+)/?$')
+_HREF_RE = re.compile(r'href\s*=\s*["\']([^"\'#]+)', re.IGNORECASE)
+
+
+def page_key(url):
+    """(URL du listing sans numero de page, numero de page) d'une URL."""
+    parts = urlsplit(url)
+    page = 1
+    path = parts.path
+    match = _PAGE_PATH_RE.search(path)
+    if match:
+        page = int(match.group(1))
+        path = path[:match.start()]
+    query = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        if key in PAGE_PARAMS and value.isdigit():
+            page = int(value)
+        else:
+            query.append((key, value))
+    base = urlunsplit((parts.scheme, parts.netloc.lower(), path.rstrip('/'),
+                       urlencode(sorted(query)), ''))
+    return base, page
+
+
+def find_page_links(html, page_url):
+    """Liens vers les autres pages du meme listing (lien 'suivant' ou numeros).
+
+    Un lien est retenu s'il pointe vers le meme listing (meme hote, chemin et
+    filtres) avec un numero de page superieur a 1. Simple recherche des href
+    dans le HTML brut : pas de second arbre BeautifulSoup.
+    """
+    base, _ = page_key(page_url)
+    pages = {}
+    for match in _HREF_RE.finditer(html):
+        link = urljoin(page_url, unescape(match.group(1).strip()))
+        link_base, number = page_key(link)
+        if link_base == base and number > 1:
+            pages.setdefault(number, link)
+    return [pages[number] for number in sorted(pages)]
+
+
+def scrape_listing(url, parse_fn, *args):
+    """Telecharge une page de listing et la parse (run_parser).
+
+    Dans un scan, les liens de pagination trouves sur la page sont notes dans
+    le contexte de GET conditionnel pour que le crawler recupere la suite.
+    """
+    html = fetch_page(url)
+    if not html:
+        return []
+    state = getattr(_fetch_context, 'conditional', None)
+    if state is not None:
+        state['pages'] = find_page_links(html, url)
+    return run_parser(parse_fn, html, *args)
+
+
+# Parsing hors processus (PARSE_WORKERS > 0) : les fonctions parse_* recoivent
+# le HTML brut et renvoient des dicts produits, executees dans un pool de
+# processus pour que le parsing (CPU, GIL) ne ralentisse pas l'API ni le SSE.
+# Le pool est cree a la demande (contexte 'spawn', sur avec les threads).
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+# Une tache n'est soumise que si un worker est libre : PARSE_TIMEOUT mesure
+# alors le temps de parsing, pas l'attente dans la file du pool
+_parse_slots = threading.BoundedSemaphore(max(1, PARSE_WORKERS))
+
+
+class ParseTimeout(Exception):
+    """Parsing d'une page interrompu apres PARSE_TIMEOUT secondes."""
+
+
+def get_parse_pool():
+    """Pool de processus de parsing partage (cree au premier usage)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _parse_pool
+
+
+def reset_parse_pool(pool):
+    """Arrete un pool, workers bloques compris ; le suivant sera recree a la demande."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    # ProcessPoolExecutor ne sait pas interrompre une tache en cours :
+    # les processus sont termines directement
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def run_parser(parse_fn, html, *args):
+    """Execute une fonction parse_* (HTML brut -> liste de produits).
+
+    Dans le thread appelant si PARSE_WORKERS = 0, sinon dans le pool de
+    processus avec une limite de PARSE_TIMEOUT secondes par page. Un worker
+    depassant la limite est tue (ParseTimeout) ; une tache perdue parce que
+    le pool a ete arrete pour un autre site est relancee une fois.
+    """
+    if PARSE_WORKERS <= 0:
+        return parse_fn(html, *args)
+
+    with _parse_slots:
+        for attempt in range(2):
+            pool = get_parse_pool()
+            try:
+                future = pool.submit(parse_fn, html, *args)
+                return future.result(timeout=PARSE_TIMEOUT)
+            except FutureTimeoutError:
+                reset_parse_pool(pool)
+                raise ParseTimeout(f"{parse_fn.__name__}: parsing interrompu apres {PARSE_TIMEOUT:g} s")
+            except BrokenProcessPool:
+                reset_parse_pool(pool)
+                if attempt:
+                    raise
+
+
+def shutdown_parse_pool():
+    """Arret du pool de parsing a la sortie du processus."""
+    with _parse_pool_lock:
+        pool = _parse_pool
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 # ============================================================
 # SCRAPERS PAR SITE
 # ============================================================
@@ -239,55 +1262,79 @@ def fetch_json(url):
         'Accept': 'application/json',
     }
     try:
-        response = http_requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        response = http_get(url, headers)
         response.raise_for_status()
         return response.json()
     except http_requests.RequestException as e:
         logger.error(f"Erreur requete JSON {url}: {e}")
+        record_fetch_error(e)
         return None
 
 
-def scrape_relictcg(url):
-    """Scraper pour RelicTCG (Shopify JSON API)."""
-    products = []
-    data = fetch_json(url)
-    if not data:
-        return products
+# Boutiques Shopify : l'endpoint public /products.json est pagine (?page=N)
+# et plafonne a 250 produits par page. Il ne permet pas de choisir les champs
+# renvoyes (body_html compris) : seul le nombre de requetes est reduit.
+SHOPIFY_PAGE_LIMIT = 250
 
-    for item in data.get('products', []):
-        try:
-            name = item.get('title', '')
-            handle = item.get('handle', '')
-            variants = item.get('variants', [])
-            images = item.get('images', [])
 
-            if not variants:
-                continue
+def shopify_product(item, base_url):
+    """Convertit un produit Shopify en produit : stock et prix sur tous les variants."""
+    variants = item.get('variants') or []
+    if not variants:
+        return None
+    name = item.get('title', '')
+    # En stock si au moins un variant est disponible ; prix du moins cher
+    # des variants disponibles (de tous les variants sinon)
+    available = [v for v in variants if v.get('available')]
+    prices = [float(v['price']) for v in (available or variants) if v.get('price')]
+    price = min(prices) if prices else None
+    images = item.get('images') or []
+    return {
+        'name': name,
+        'price': price if price and price > 0 else None,
+        'in_stock': bool(available), 'preorder': False,
+        'url': f"{base_url}/products/{item.get('handle', '')}",
+        'image_url': images[0].get('src', '') if images else '',
+        'set_code': detect_set_code(name),
+    }
 
-            variant = variants[0]
-            price_str = variant.get('price', '0')
-            price = float(price_str) if price_str else None
-            in_stock = variant.get('available', False)
-            image_url = images[0].get('src', '') if images else ''
-            product_url = f"https://www.relictcg.com/products/{handle}"
 
-            products.append({
-                'name': name,
-                'price': price if price and price > 0 else None,
-                'in_stock': in_stock, 'preorder': False,
-                'url': product_url,
-                'image_url': image_url,
-                'set_code': detect_set_code(name),
-            })
+def scrape_shopify(url):
+    """Scraper Shopify generique (/products.json d'une collection ou de la boutique).
+
+    Chaque page est demandee avec limit=250 ; si elle est pleine, la page
+    suivante est signalee au crawler de pagination comme pour un listing HTML.
+    """
+    parts = urlsplit(url)
+    base_url = f"{parts.scheme}://{parts.netloc}"
+    query = dict(parse_qsl(parts.query))
+    page = int(query.get('page') or 1)
+    query['limit'] = str(SHOPIFY_PAGE_LIMIT)
+    data = fetch_json(urlunsplit(parts._replace(query=urlencode(query))))
+    if not data:
+        return []
+
+    products = []
+    items = data.get('products', [])
+    for item in items:
+        try:
+            product = shopify_product(item, base_url)
+            if product:
+                products.append(product)
         except Exception as e:
-            logger.warning(f"Erreur parsing RelicTCG: {e}")
+            logger.warning(f"Erreur parsing Shopify {parts.netloc}: {e}")
 
-    logger.info(f"RelicTCG: {len(products)} produits trouves")
+    state = getattr(_fetch_context, 'conditional', None)
+    if state is not None and len(items) >= SHOPIFY_PAGE_LIMIT:
+        next_query = dict(parse_qsl(parts.query), page=str(page + 1))
+        state['pages'] = [urlunsplit(parts._replace(query=urlencode(next_query)))]
+
+    logger.info(f"Shopify {parts.netloc} page {page}: {len(products)} produits trouves")
     return products
 
 
-def scrape_destocktcg(url):
-    """Scraper pour DestockTCG (site custom PHP).
+def parse_destocktcg(html):
+    """Extrait les produits d'une page DestockTCG (site custom PHP).
 
     Structure HTML verifiee (fevrier 2026) :
       article.product-item-list
@@ -303,11 +1350,7 @@ def scrape_destocktcg(url):
             > div.product-item-name.text-truncate > a[href]
     """
     products = []
-    html = fetch_page(url)
-    if not html:
-        return products
-
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html, 'destocktcg', DESTOCKTCG_GRID)
 
     for item in soup.select('article.product-item-list'):
         try:
@@ -362,20 +1405,23 @@ def scrape_destocktcg(url):
     return products
 
 
-def scrape_woocommerce(url, base_url):
-    """Scraper generique pour sites WooCommerce standard (ex: Guizette Family).
+def scrape_destocktcg(url):
+    """Scraper pour DestockTCG : telechargement puis parsing (parse_destocktcg)."""
+    return scrape_listing(url, parse_destocktcg)
+
+
+def parse_woocommerce(html, base_url, site_slug=''):
+    """Extrait les produits d'une page WooCommerce standard (ex: Guizette Family).
 
     Utilise les selecteurs WooCommerce classiques :
       ul.products > li.product
       .woocommerce-loop-product__title
       .woocommerce-Price-amount
+
+    `site_slug` selectionne le backend de parsing du site (FAST_PARSER_SITES).
     """
     products = []
-    html = fetch_page(url)
-    if not html:
-        return products
-
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html, site_slug, WOOCOMMERCE_GRID)
 
     for item in soup.select(
         'li.product, .product-item, .type-product, '
@@ -454,8 +1500,13 @@ def scrape_woocommerce(url, base_url):
     return products
 
 
-def scrape_coindesbarons(url):
-    """Scraper dedie au Coin des Barons (WooCommerce theme custom 'barons').
+def scrape_woocommerce(url, base_url, site_slug=''):
+    """Scraper WooCommerce generique : telechargement puis parsing (parse_woocommerce)."""
+    return scrape_listing(url, parse_woocommerce, base_url, site_slug)
+
+
+def parse_coindesbarons(html):
+    """Extrait les produits d'une page du Coin des Barons (WooCommerce theme custom 'barons').
 
     Structure HTML verifiee (fevrier 2026) :
       div.products.lists__wrap
@@ -476,11 +1527,7 @@ def scrape_coindesbarons(url):
     Strategie : on utilise le JSON GTM4WP en priorite (fiable), avec fallback HTML.
     """
     products = []
-    html = fetch_page(url)
-    if not html:
-        return products
-
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html, 'coindesbarons', COINDESBARONS_GRID)
 
     for item in soup.select('.card-game'):
         try:
@@ -584,8 +1631,13 @@ def scrape_coindesbarons(url):
     return products
 
 
-def scrape_philibert(url):
-    """Scraper pour Philibert (PrestaShop 1.6-era theme sur philibertnet.com).
+def scrape_coindesbarons(url):
+    """Scraper pour Le Coin des Barons : telechargement puis parsing (parse_coindesbarons)."""
+    return scrape_listing(url, parse_coindesbarons)
+
+
+def parse_philibert(html):
+    """Extrait les produits d'une page Philibert (PrestaShop 1.6-era theme sur philibertnet.com).
 
     Structure HTML verifiee (fevrier 2026) :
       ul.product_list.grid
@@ -608,11 +1660,7 @@ def scrape_philibert(url):
     Le dataLayer JS contient aussi les donnees produits (impressions).
     """
     products = []
-    html = fetch_page(url)
-    if not html:
-        return products
-
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html, 'philibert', PHILIBERT_GRID)
 
     # Strategie 1 : parsing HTML des blocs produit
     for item in soup.select('li.ajax_block_product'):
@@ -701,8 +1749,13 @@ def scrape_philibert(url):
     return products
 
 
-def scrape_ultrajeux(url):
-    """Scraper pour UltraJeux (site custom).
+def scrape_philibert(url):
+    """Scraper pour Philibert : telechargement puis parsing (parse_philibert)."""
+    return scrape_listing(url, parse_philibert)
+
+
+def parse_ultrajeux(html):
+    """Extrait les produits d'une page UltraJeux (site custom).
 
     Structure HTML verifiee (fevrier 2026) :
       div.block_produit
@@ -715,11 +1768,7 @@ def scrape_ultrajeux(url):
               > p.disponibilite > span > b         (Disponible / Indisponible)
     """
     products = []
-    html = fetch_page(url)
-    if not html:
-        return products
-
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html, 'ultrajeux', ULTRAJEUX_GRID)
 
     for block in soup.select('div.block_produit'):
         try:
@@ -761,8 +1810,13 @@ def scrape_ultrajeux(url):
     return products
 
 
-def scrape_antretemps(url):
-    """Scraper pour L'Antre des Temps (CMS custom, antretemps.com).
+def scrape_ultrajeux(url):
+    """Scraper pour UltraJeux : telechargement puis parsing (parse_ultrajeux)."""
+    return scrape_listing(url, parse_ultrajeux)
+
+
+def parse_antretemps(html):
+    """Extrait les produits d'une page de L'Antre des Temps (CMS custom, antretemps.com).
 
     Structure HTML verifiee (fevrier 2026) :
       div.product_box
@@ -775,11 +1829,7 @@ def scrape_antretemps(url):
             > div.bp_prix                           (texte prix, ex: "18,90 euro")
     """
     products = []
-    html = fetch_page(url)
-    if not html:
-        return products
-
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html, 'antretemps', ANTRETEMPS_GRID)
 
     for box in soup.select('div.product_box'):
         try:
@@ -817,8 +1867,13 @@ def scrape_antretemps(url):
     return products
 
 
-def scrape_cardshunter(url):
-    """Scraper pour Cards Hunter (WooCommerce + JetEngine/Elementor).
+def scrape_antretemps(url):
+    """Scraper pour L'Antre des Temps : telechargement puis parsing (parse_antretemps)."""
+    return scrape_listing(url, parse_antretemps)
+
+
+def parse_cardshunter(html):
+    """Extrait les produits d'une page Cards Hunter (WooCommerce + JetEngine/Elementor).
 
     Structure HTML verifiee (fevrier 2026) :
       div.jet-listing-grid__items
@@ -835,11 +1890,7 @@ def scrape_cardshunter(url):
                 > .woocommerce-Price-amount           (prix normal)
     """
     products = []
-    html = fetch_page(url)
-    if not html:
-        return products
-
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html, 'cardshunter', CARDSHUNTER_GRID)
     grid = soup.select_one('.jet-listing-grid__items')
     if not grid:
         logger.warning("Cards Hunter: grille JetEngine introuvable")
@@ -889,60 +1940,671 @@ def scrape_cardshunter(url):
     return products
 
 
+def scrape_cardshunter(url):
+    """Scraper pour Cards Hunter : telechargement puis parsing (parse_cardshunter)."""
+    return scrape_listing(url, parse_cardshunter)
+
+
 # Registre des scrapers : slug -> fonction
 SCRAPER_REGISTRY = {
-    'relictcg': scrape_relictcg,
+    'relictcg': scrape_shopify,
     'destocktcg': scrape_destocktcg,
     'coindesbarons': scrape_coindesbarons,
     'philibert': scrape_philibert,
     'ultrajeux': scrape_ultrajeux,
-    'guizettefamily': lambda url: scrape_woocommerce(url, 'https://www.guizettefamily.com'),
+    'guizettefamily': lambda url: scrape_woocommerce(
+        url, 'https://www.guizettefamily.com', 'guizettefamily'),
     'antretemps': scrape_antretemps,
     'cardshunter': scrape_cardshunter,
 }
 
 
+def get_scraper(site):
+    """Scraper d'un site : celui du registre, sinon scrape_shopify si toutes
+    ses URLs de recherche sont des /products.json (boutique Shopify)."""
+    scraper_fn = SCRAPER_REGISTRY.get(site['slug'])
+    if scraper_fn:
+        return scraper_fn
+    search_urls = json.loads(site['search_urls']) if site['search_urls'] else []
+    if search_urls and all(urlsplit(u).path.endswith('/products.json') for u in search_urls):
+        return scrape_shopify
+    return None
+
+
 # ============================================================
 # SCANNER
 # ============================================================
 
-def save_product(conn, site_id, product_data):
-    """Sauvegarde ou met a jour un produit et son historique de prix."""
-    url = product_data.get('url', '')
-    if not url:
-        return
-
-    existing = conn.execute("SELECT id FROM products WHERE url = ?", (url,)).fetchone()
+def save_products(conn, site_id, products):
+    """Ecrit en lot les produits d'un site : upsert, historique et etat courant.
 
-    if existing:
-        product_id = existing['id']
-        conn.execute(
-            """UPDATE products SET name = ?, set_code = COALESCE(?, set_code),
-               image_url = COALESCE(NULLIF(?, ''), image_url), last_seen = CURRENT_TIMESTAMP
-               WHERE id = ?""",
-            (product_data['name'], product_data.get('set_code'),
-             product_data.get('image_url', ''), product_id)
+    Les produits sont d'abord places dans une table de staging temporaire
+    (executemany), puis appliques en requetes ensemblistes. En mode
+    HISTORY_MODE='changes', un releve identique a l'etat courant (prix,
+    stock, precommande) ne cree pas de ligne : il prolonge seulement
+    `last_confirmed_at` de la ligne courante. Aucun commit : l'appelant
+    decide de la transaction englobante.
+    Retourne le nombre de produits ecrits.
+    """
+    staged = {}
+    for product in products:
+        url = product.get('url', '')
+        if not url:
+            continue
+        staged[url] = (
+            url, product['name'], product.get('set_code'), product.get('image_url', ''),
+            product.get('price'),
+            1 if product.get('in_stock') else 0,
+            1 if product.get('preorder') else 0,
         )
-    else:
-        cursor = conn.execute(
-            """INSERT INTO products (site_id, name, set_code, url, image_url)
-               VALUES (?, ?, ?, ?, ?)""",
-            (site_id, product_data['name'], product_data.get('set_code'),
-             url, product_data.get('image_url', ''))
+    if not staged:
+        return 0
+
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS staging_products (
+            url TEXT PRIMARY KEY, name TEXT, set_code TEXT, image_url TEXT,
+            price REAL, in_stock INTEGER, preorder INTEGER,
+            product_id INTEGER, changed INTEGER DEFAULT 1
         )
-        product_id = cursor.lastrowid
+    """)
+    conn.execute("DELETE FROM staging_products")
+    conn.executemany(
+        """INSERT INTO staging_products (url, name, set_code, image_url, price, in_stock, preorder)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        staged.values()
+    )
 
     conn.execute(
-        "INSERT INTO price_history (product_id, price, in_stock, preorder) VALUES (?, ?, ?, ?)",
-        (product_id, product_data.get('price'),
-         1 if product_data.get('in_stock') else 0,
-         1 if product_data.get('preorder') else 0)
+        """INSERT INTO products (site_id, name, set_code, url, image_url)
+           SELECT ?, name, set_code, url, image_url FROM staging_products WHERE true
+           ON CONFLICT(url) DO UPDATE SET
+               name = excluded.name,
+               set_code = COALESCE(excluded.set_code, products.set_code),
+               image_url = COALESCE(NULLIF(excluded.image_url, ''), products.image_url),
+               last_seen = CURRENT_TIMESTAMP""",
+        (site_id,)
     )
-    conn.commit()
+    conn.execute("""
+        UPDATE staging_products
+        SET product_id = (SELECT id FROM products WHERE url = staging_products.url)
+    """)
+
+    if HISTORY_MODE == 'changes':
+        conn.execute("""
+            UPDATE staging_products SET changed = NOT EXISTS (
+                SELECT 1 FROM product_latest pl
+                WHERE pl.product_id = staging_products.product_id
+                  AND pl.price IS staging_products.price
+                  AND pl.in_stock = staging_products.in_stock
+                  AND pl.preorder = staging_products.preorder
+            )
+        """)
+        # Etat inchange : prolonger la ligne courante au lieu d'en creer une
+        conn.execute("""
+            UPDATE price_history SET last_confirmed_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT pl.history_id FROM product_latest pl
+                JOIN staging_products s ON s.product_id = pl.product_id
+                WHERE s.changed = 0
+            )
+        """)
+        conn.execute("""
+            UPDATE product_latest SET checked_at = CURRENT_TIMESTAMP
+            WHERE product_id IN (SELECT product_id FROM staging_products WHERE changed = 0)
+        """)
+
+    last_history_id = conn.execute(
+        "SELECT COALESCE(MAX(id), 0) FROM price_history"
+    ).fetchone()[0]
+    conn.execute("""
+        INSERT INTO price_history (product_id, price, in_stock, preorder, last_confirmed_at)
+        SELECT product_id, price, in_stock, preorder, CURRENT_TIMESTAMP
+        FROM staging_products WHERE changed = 1
+    """)
+    # Etat courant tenu a jour dans la meme transaction que l'historique
+    conn.execute(
+        """INSERT INTO product_latest (product_id, history_id, price, in_stock, preorder, checked_at)
+           SELECT product_id, id, price, in_stock, preorder, checked_at
+           FROM price_history WHERE id > ?
+           ON CONFLICT(product_id) DO UPDATE SET
+               history_id = excluded.history_id, price = excluded.price,
+               in_stock = excluded.in_stock, preorder = excluded.preorder,
+               checked_at = excluded.checked_at""",
+        (last_history_id,)
+    )
+    return len(staged)
+
+
+def save_product(conn, site_id, product_data):
+    """Sauvegarde ou met a jour un produit et son historique de prix."""
+    with conn:
+        save_products(conn, site_id, [product_data])
+
+
+def delete_stale_products(conn, site_id, scan_start):
+    """Supprime les produits d'un site non vus depuis `scan_start` (ensembliste)."""
+    stale = "SELECT id FROM products WHERE site_id = ? AND last_seen < ?"
+    conn.execute(f"DELETE FROM price_history WHERE product_id IN ({stale})", (site_id, scan_start))
+    conn.execute(f"DELETE FROM product_latest WHERE product_id IN ({stale})", (site_id, scan_start))
+    for table, _ in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE product_id IN ({stale})", (site_id, scan_start))
+    return conn.execute(
+        "DELETE FROM products WHERE site_id = ? AND last_seen < ?", (site_id, scan_start)
+    ).rowcount
+
+
+def update_rollups(conn, site_id, scan_start, product_ids=None):
+    """Ajoute le releve de ce scan aux agregats horaires et journaliers.
+
+    Tous les produits du site vus depuis `scan_start` (sauvegardes ou
+    court-circuites) contribuent un echantillon, a partir de leur etat
+    courant dans product_latest ; `product_ids` restreint a ces produits
+    (releve de la surveillance des reassorts).
+    """
+    condition, extra = '', ()
+    if product_ids is not None:
+        condition = f" AND pl.product_id IN ({', '.join('?' * len(product_ids))})"
+        extra = tuple(product_ids)
+    for table, bucket_fmt in ROLLUP_TABLES:
+        conn.execute(
+            f"""INSERT INTO {table} (product_id, bucket, min_price, max_price, last_price,
+                                     samples, in_stock_samples, last_at)
+                SELECT pl.product_id, strftime(?, 'now'), pl.price, pl.price, pl.price,
+                       1, pl.in_stock, CURRENT_TIMESTAMP
+                FROM product_latest pl JOIN products p ON p.id = pl.product_id
+                WHERE p.site_id = ? AND p.last_seen >= ?{condition}
+                ON CONFLICT(product_id, bucket) DO UPDATE SET
+                    min_price = COALESCE(MIN(min_price, excluded.min_price), min_price, excluded.min_price),
+                    max_price = COALESCE(MAX(max_price, excluded.max_price), max_price, excluded.max_price),
+                    last_price = excluded.last_price,
+                    samples = samples + 1,
+                    in_stock_samples = in_stock_samples + excluded.in_stock_samples,
+                    last_at = excluded.last_at""",
+            (bucket_fmt, site_id, scan_start, *extra)
+        )
+
+
+def load_url_cache(conn, site_id):
+    """Charge les validateurs HTTP et les produits du dernier scan d'un site, par URL."""
+    return {row['url']: row for row in conn.execute(
+        "SELECT * FROM url_cache WHERE site_id = ?", (site_id,)
+    ).fetchall()}
+
+
+def fetch_listing_page(scraper_fn, url, cached):
+    """Recupere une page de listing avec GET conditionnel.
+
+    Retourne (outcome, produits, pages suivantes, mise a jour du cache,
+    octets recus) ; outcome vaut 'ok', 'not_modified' ou 'unchanged'. Une page
+    court-circuitee reprend ses produits et ses liens de pagination du scan
+    precedent.
+    """
+    try:
+        with conditional_fetch(cached) as validators:
+            found = scraper_fn(url)
+        # Page en erreur (404, 5xx ou erreur reseau apres retries, page sans
+        # reponse 200) : signalee pour que ses produits ne soient pas
+        # supprimes comme obsoletes
+        if validators['error'] or validators['status'] != 200:
+            raise RuntimeError(validators['error'] or f"HTTP {validators['status']}")
+        return 'ok', found, validators['pages'], (url, validators, found), validators['bytes']
+    except NotModified as e:
+        found = json.loads(cached['products']) if cached['products'] else []
+        pages = json.loads(cached['pages']) if cached['pages'] else []
+        if isinstance(e, ContentUnchanged):
+            # Corps identique mais nouveaux validateurs (ETag regenere...) :
+            # ils sont enregistres, sinon chaque scan repartirait en 200 complet
+            validators['pages'] = pages
+            return 'unchanged', found, pages, (url, validators, found), validators['bytes']
+        return 'not_modified', found, pages, None, validators['bytes']
+
+
+def fetch_site_products(site, url_cache):
+    """Recupere les produits de toutes les URLs de recherche d'un site.
+
+    Execute dans un thread du pool de scan : uniquement reseau + parsing,
+    aucune ecriture en base (la connexion SQLite reste au coordinateur).
+    Pour chaque URL de recherche, la premiere page donne les liens de
+    pagination ; les pages suivantes (au plus LISTING_MAX_PAGES) sont
+    recuperees en parallele, la politesse par hote etant appliquee par
+    host_slot, puis dedupliquees et fusionnees. Une page repondant 304, ou
+    dont le corps est identique au scan precedent, est court-circuitee : elle
+    n'est pas parsee et ses produits (repris du cache) sont simplement
+    marques comme vus.
+    """
+    scraper_fn = get_scraper(site)
+    fetched = {
+        'products': [], 'unchanged_products': [], 'cache_updates': [],
+        'not_modified': 0, 'unchanged': 0, 'pages': 0, 'errors': 0, 'bytes': 0,
+    }
+    search_urls = json.loads(site['search_urls']) if site['search_urls'] else []
+    fresh, unchanged = {}, {}
+
+    def collect(url, result):
+        outcome, found, pages, update, nbytes = result
+        fetched['pages'] += 1
+        fetched['bytes'] += nbytes
+        if update:
+            fetched['cache_updates'].append(update)
+        target = fresh if outcome == 'ok' else unchanged
+        for product in found:
+            target[product.get('url') or id(product)] = product
+        if outcome == 'ok':
+            logger.info(f"  {url} -> {len(found)} produits")
+        else:
+            fetched[outcome] += 1
+            reason = '304' if outcome == 'not_modified' else 'contenu identique'
+            logger.info(f"  {url} -> {reason}, {len(found)} produits inchanges")
+        return pages
+
+    logger.info(f"Scan de {site['name']}...")
+    for url in search_urls:
+        try:
+            pages = collect(url, fetch_listing_page(scraper_fn, url, url_cache.get(url)))
+        except Exception as e:
+            fetched['errors'] += 1
+            logger.error(f"  Erreur sur {url}: {e}")
+            continue
+
+        # Pages suivantes : nouvelles pages decouvertes a chaque vague
+        seen = {page_key(url)}
+        frontier = pages
+        while frontier and len(seen) < LISTING_MAX_PAGES:
+            batch = []
+            for page_url in frontier:
+                key = page_key(page_url)
+                if key not in seen and len(seen) < LISTING_MAX_PAGES:
+                    seen.add(key)
+                    batch.append(page_url)
+            if not batch:
+                break
+            frontier = []
+            workers = max(1, min(LISTING_PAGE_WORKERS, len(batch)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='page') as executor:
+                futures = {
+                    executor.submit(fetch_listing_page, scraper_fn, page_url,
+                                    url_cache.get(page_url)): page_url
+                    for page_url in batch
+                }
+                for future in as_completed(futures):
+                    page_url = futures[future]
+                    try:
+                        frontier.extend(collect(page_url, future.result()))
+                    except Exception as e:
+                        fetched['errors'] += 1
+                        logger.error(f"  Erreur sur {page_url}: {e}")
+        if any(page_key(page_url) not in seen for page_url in frontier):
+            logger.warning(f"  {url}: pagination tronquee a {LISTING_MAX_PAGES} pages")
+
+    # Un produit present sur plusieurs pages (ou URLs) n'est compte qu'une fois
+    fetched['products'] = list(fresh.values())
+    fetched['unchanged_products'] = [p for key, p in unchanged.items() if key not in fresh]
+    return fetched
+
+
+def save_url_cache(conn, site_id, cache_updates):
+    """Enregistre les validateurs HTTP, l'empreinte, les produits parses et les
+    liens de pagination par URL."""
+    for url, validators, products in cache_updates:
+        conn.execute(
+            """INSERT INTO url_cache (url, site_id, etag, last_modified, content_hash,
+                                      products, pages, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+               ON CONFLICT(url) DO UPDATE SET
+                   site_id = excluded.site_id, etag = excluded.etag,
+                   last_modified = excluded.last_modified,
+                   content_hash = excluded.content_hash,
+                   products = excluded.products, pages = excluded.pages,
+                   updated_at = CURRENT_TIMESTAMP""",
+            (url, site_id, validators['etag'], validators['last_modified'],
+             validators['content_hash'], json.dumps(products),
+             json.dumps(validators['pages']))
+        )
+
+
+def refresh_last_seen(conn, site_id, products):
+    """Marque comme vus, en une seule requete groupee, des produits inchanges.
+
+    Un produit du cache absent de la base (page de pagination non suivie au
+    scan precedent, nettoyee depuis) est re-sauvegarde depuis le cache.
+    """
+    displays = {p['url']: p for p in products
+                if p.get('url') and is_french_display(p['name'])}
+    if not displays:
+        return 0
+    keys = [(site_id, url) for url in displays]
+    cursor = conn.executemany(
+        "UPDATE products SET last_seen = CURRENT_TIMESTAMP WHERE site_id = ? AND url = ?", keys
+    )
+    refreshed = cursor.rowcount
+    # Etat reconfirme par ce scan : prolonger la ligne d'historique courante
+    # et la date de releve, comme save_products pour un etat inchange
+    conn.executemany(
+        """UPDATE price_history SET last_confirmed_at = CURRENT_TIMESTAMP
+           WHERE id = (SELECT pl.history_id FROM product_latest pl
+                       JOIN products p ON p.id = pl.product_id
+                       WHERE p.site_id = ? AND p.url = ?)""", keys
+    )
+    conn.executemany(
+        """UPDATE product_latest SET checked_at = CURRENT_TIMESTAMP
+           WHERE product_id = (SELECT id FROM products WHERE site_id = ? AND url = ?)""", keys
+    )
+    if refreshed < len(displays):
+        existing = {row['url'] for row in conn.execute(
+            "SELECT url FROM products WHERE site_id = ?", (site_id,)
+        )}
+        missing = [p for url, p in displays.items() if url not in existing]
+        refreshed += save_products(conn, site_id, missing)
+    return refreshed
+
+
+def store_site_products(conn, site, fetched):
+    """Sauvegarde les displays FR d'un site et nettoie ses produits obsoletes.
+
+    Toutes les ecritures du site (cache HTTP, upsert des produits, last_seen
+    des URLs court-circuitees, nettoyage) partagent une seule transaction.
+    """
+    site_products = fetched['products']
+    displays = [p for p in site_products if is_french_display(p['name'])]
+    logger.info(f"  {site['name']}: {len(displays)}/{len(site_products)} sont des displays FR")
+
+    write_start = time.perf_counter()
+    with conn:
+        # Debut des ecritures du site, horloge SQLite (comparable a last_seen)
+        scan_start = conn.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        save_url_cache(conn, site['id'], fetched['cache_updates'])
+        saved = save_products(conn, site['id'], displays)
+        # URLs court-circuitees : pas de parsing ni d'upsert, juste last_seen
+        refreshed = refresh_last_seen(conn, site['id'], fetched['unchanged_products'])
+        # Nettoyage : supprimer les produits de ce site non vus dans ce scan,
+        # sauf si une page a echoue (ses produits n'ont pas pu etre vus)
+        stale = 0
+        if not fetched['errors']:
+            stale = delete_stale_products(conn, site['id'], scan_start)
+        update_rollups(conn, site['id'], scan_start)
+    write_time = time.perf_counter() - write_start
+    rows_per_sec = round((saved + refreshed) / write_time) if write_time > 0 else 0
+
+    if stale:
+        logger.info(f"  Nettoyage: {stale} produit(s) obsolete(s) supprime(s)")
+    if fetched['errors']:
+        logger.warning(f"  {site['name']}: {fetched['errors']} page(s) en erreur, nettoyage ignore")
+
+    short_circuited = fetched['not_modified'] + fetched['unchanged']
+    total_found = len(site_products) + len(fetched['unchanged_products'])
+    logger.info(
+        f"  {site['name']}: {saved} sauvegardes ({len(displays)} displays FR / {len(site_products)} parses), "
+        f"{refreshed} inchanges ({short_circuited}/{fetched['pages']} page(s) court-circuitee(s)), "
+        f"{fetched['bytes'] / 1024:.0f} Ko recus, "
+        f"ecriture {write_time * 1000:.0f} ms ({rows_per_sec} lignes/s)"
+    )
+    return {
+        'status': 'ok', 'count': saved + refreshed, 'total_found': total_found,
+        'displays_fr': len(displays) + refreshed, 'refreshed': refreshed,
+        'not_modified': fetched['not_modified'], 'unchanged': fetched['unchanged'],
+        'short_circuited': short_circuited, 'stale_removed': stale,
+        'pages': fetched['pages'], 'page_errors': fetched['errors'],
+        'payload_bytes': fetched['bytes'],
+        'write_ms': round(write_time * 1000, 1), 'rows_per_sec': rows_per_sec,
+    }
+
+
+# ============================================================
+# FILE DE JOBS DE SCAN
+# ============================================================
+
+# Un scan est decoupe en un job par site dans la table scan_jobs. Le
+# coordinateur (run_scan, detenteur du bail 'scan') cree les jobs puis agrege
+# leurs resultats dans scan_log. Tout processus partageant la base (threads du
+# coordinateur, `python app.py worker`) reclame les jobs de facon atomique,
+# signale sa progression (heartbeat) et enregistre lui-meme les produits du
+# site. Un job dont le heartbeat s'arrete (processus tue) est remis en file,
+# jusqu'a SCAN_JOB_MAX_ATTEMPTS tentatives.
+
+def requeue_stale_jobs(conn):
+    """Remet en file les jobs dont le worker ne donne plus signe de vie."""
+    deadline = time.time() - LEASE_TTL
+    requeued = conn.execute(
+        "UPDATE scan_jobs SET status = 'pending', worker = NULL "
+        "WHERE status = 'running' AND heartbeat_at < ? AND attempts < ?",
+        (deadline, SCAN_JOB_MAX_ATTEMPTS)
+    ).rowcount
+    abandoned = conn.execute(
+        "UPDATE scan_jobs SET status = 'failed', result = ?, finished_at = CURRENT_TIMESTAMP "
+        "WHERE status = 'running' AND heartbeat_at < ?",
+        (json.dumps({'status': 'error', 'count': 0}), deadline)
+    ).rowcount
+    if requeued or abandoned:
+        logger.warning(f"File de scan: {requeued} job(s) remis en file, {abandoned} abandonne(s)")
+
+
+def claim_scan_job(scan_id=None):
+    """Reclame le plus ancien job en attente (d'un scan donne, ou de tous).
+
+    Une seule requete UPDATE ... RETURNING : deux workers ne peuvent pas
+    obtenir le meme job. Retourne le job (id, scan_id, site_id, attempts)
+    ou None si la file est vide.
+    """
+    with writer_db() as conn:
+        with conn:
+            requeue_stale_jobs(conn)
+            rows = conn.execute(
+                """UPDATE scan_jobs SET status = 'running', worker = ?, heartbeat_at = ?,
+                          attempts = attempts + 1, started_at = CURRENT_TIMESTAMP
+                   WHERE id = (SELECT id FROM scan_jobs
+                               WHERE status = 'pending' AND (? IS NULL OR scan_id = ?)
+                               ORDER BY id LIMIT 1)
+                   RETURNING id, scan_id, site_id, attempts""",
+                (worker_id(), time.time(), scan_id, scan_id)
+            ).fetchall()
+    return rows[0] if rows else None
+
+
+def renew_scan_job(job_id):
+    """Heartbeat d'un job ; False si le job a ete repris par un autre worker."""
+    with writer_db() as conn:
+        with conn:
+            return conn.execute(
+                "UPDATE scan_jobs SET heartbeat_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), job_id, worker_id())
+            ).rowcount == 1
+
+
+def finish_scan_job(job_id, status, result):
+    """Enregistre le resultat d'un job encore detenu par ce worker."""
+    with writer_db() as conn:
+        with conn:
+            return conn.execute(
+                "UPDATE scan_jobs SET status = ?, result = ?, finished_at = CURRENT_TIMESTAMP "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, json.dumps(result), job_id, worker_id())
+            ).rowcount == 1
+
+
+def requeue_scan_job(job_id):
+    """Remet en file un job de ce worker interrompu par une erreur inattendue.
+
+    Le job est abandonne s'il a deja epuise ses SCAN_JOB_MAX_ATTEMPTS tentatives.
+    """
+    with writer_db() as conn:
+        with conn:
+            conn.execute(
+                """UPDATE scan_jobs SET
+                       status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END,
+                       result = CASE WHEN attempts < ? THEN NULL ELSE ? END,
+                       finished_at = CASE WHEN attempts < ? THEN NULL ELSE CURRENT_TIMESTAMP END,
+                       worker = NULL
+                   WHERE id = ? AND worker = ? AND status = 'running'""",
+                (SCAN_JOB_MAX_ATTEMPTS, SCAN_JOB_MAX_ATTEMPTS,
+                 json.dumps({'status': 'error', 'count': 0}), SCAN_JOB_MAX_ATTEMPTS,
+                 job_id, worker_id())
+            )
+
+
+def process_scan_job(job):
+    """Scanne le site d'un job : reseau + parsing puis ecriture des produits."""
+    stop_heartbeat = start_heartbeat(f"job {job['id']}", lambda: renew_scan_job(job['id']))
+    site = None
+    try:
+        with writer_db() as conn:
+            site = conn.execute("SELECT * FROM sites WHERE id = ?", (job['site_id'],)).fetchone()
+            url_cache = load_url_cache(conn, job['site_id'])
+        fetched = fetch_site_products(site, url_cache)
+        # L'ecrivain n'est tenu que le temps de la transaction du site
+        with writer_db() as conn:
+            result = store_site_products(conn, site, fetched)
+        status = 'done'
+    except Exception as e:
+        logger.error(f"  Erreur sur {site['name'] if site else job['site_id']}: {e}")
+        result = {'status': 'error', 'count': 0}
+        status = 'failed'
+    finally:
+        stop_heartbeat()
+    if not finish_scan_job(job['id'], status, result):
+        logger.warning(f"Job {job['id']} repris par un autre worker, resultat ignore")
+
+
+def queue_worker(stop, scan_id=None):
+    """Boucle d'un thread worker : reclame et traite des jobs jusqu'a `stop`."""
+    while not stop.is_set():
+        try:
+            job = claim_scan_job(scan_id)
+        except sqlite3.Error as e:
+            logger.warning(f"File de scan indisponible: {e}")
+            job = None
+        if job is None:
+            stop.wait(SCAN_QUEUE_POLL)
+            continue
+        try:
+            process_scan_job(job)
+        except Exception as e:
+            # Typiquement 'database is locked' a l'enregistrement du resultat :
+            # le thread survit et le job repart en file
+            logger.error(f"Job {job['id']} interrompu: {e}")
+            try:
+                requeue_scan_job(job['id'])
+            except sqlite3.Error as e:
+                # Sans heartbeat, requeue_stale_jobs le reprendra apres LEASE_TTL
+                logger.warning(f"Job {job['id']} non remis en file: {e}")
+            stop.wait(SCAN_QUEUE_POLL)
+
+
+def scan_job_results(conn, scan_id):
+    """Resultats des jobs termines d'un scan, par slug de site."""
+    return {
+        row['slug']: json.loads(row['result']) if row['result'] else {'status': 'error', 'count': 0}
+        for row in conn.execute(
+            """SELECT s.slug, j.result FROM scan_jobs j JOIN sites s ON s.id = j.site_id
+               WHERE j.scan_id = ? AND j.status IN ('done', 'failed') ORDER BY j.id""",
+            (scan_id,)
+        )
+    }
+
+
+def wait_for_scan_jobs(scan_id, abort=None, report=True):
+    """Attend la fin des jobs d'un scan en publiant la progression site par site.
+
+    Avec report=False (scan par site), la progression n'est ni gardee dans
+    last_scan_info ni diffusee aux clients SSE. Apres SCAN_TIMEOUT_MINUTES (aucun worker ne traite plus la file, par
+    exemple), les jobs restants sont marques en echec. Si l'evenement `abort`
+    est leve (bail du coordinateur perdu), les jobs pas encore commences sont
+    annules. Retourne False dans ces deux cas.
+    """
+    reported = set()
+    deadline = time.monotonic() + SCAN_TIMEOUT_MINUTES * 60
+    timed_out = False
+    while True:
+        try:
+            with writer_db() as conn:
+                with conn:
+                    requeue_stale_jobs(conn)
+                    if abort is not None and abort.is_set():
+                        cancelled = conn.execute(
+                            "UPDATE scan_jobs SET status = 'failed', result = ?, "
+                            "finished_at = CURRENT_TIMESTAMP "
+                            "WHERE scan_id = ? AND status = 'pending'",
+                            (json.dumps({'status': 'cancelled', 'count': 0}), scan_id)
+                        ).rowcount
+                        logger.error(f"Bail perdu, scan interrompu ({cancelled} job(s) annule(s))")
+                        return False
+                    if time.monotonic() > deadline and not timed_out:
+                        abandoned = conn.execute(
+                            "UPDATE scan_jobs SET status = 'failed', result = ?, "
+                            "finished_at = CURRENT_TIMESTAMP "
+                            "WHERE scan_id = ? AND status IN ('pending', 'running')",
+                            (json.dumps({'status': 'timeout', 'count': 0}), scan_id)
+                        ).rowcount
+                        timed_out = True
+                        logger.error(f"Scan depasse ({SCAN_TIMEOUT_MINUTES:g} min), "
+                                     f"{abandoned} job(s) abandonne(s)")
+                jobs = conn.execute(
+                    """SELECT j.id, j.status, j.result, s.slug, s.name
+                       FROM scan_jobs j JOIN sites s ON s.id = j.site_id WHERE j.scan_id = ?""",
+                    (scan_id,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Suivi des jobs de scan impossible: {e}")
+            if time.monotonic() > deadline or (abort is not None and abort.is_set()):
+                return False
+            time.sleep(SCAN_QUEUE_POLL)
+            continue
+        for job in jobs:
+            if job['status'] not in ('done', 'failed') or job['id'] in reported:
+                continue
+            reported.add(job['id'])
+            if not report:
+                continue
+            result = json.loads(job['result']) if job['result'] else {'status': 'error', 'count': 0}
+            last_scan_info['results'][job['slug']] = result
+            last_scan_info['sites_done'] = len(last_scan_info['results'])
+            broadcast_event('scan:progress', {
+                'site_name': job['name'],
+                'sites_done': last_scan_info['sites_done'],
+                'sites_total': last_scan_info['sites_total'],
+                'products_found': result['count'],
+            })
+        if len(reported) == len(jobs):
+            return not timed_out
+        time.sleep(SCAN_QUEUE_POLL)
+
+
+def run_worker():
+    """Mode worker (`python app.py worker`) : traite la file de scan sans servir l'API.
+
+    SCAN_WORKERS threads reclament les jobs de tous les scans ; le processus
+    peut tourner sur n'importe quel noeud ayant acces a la base.
+    """
+    logger.info(f"Worker de scan {worker_id()} demarre ({SCAN_WORKERS} thread(s))")
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=queue_worker, args=(stop,), daemon=True, name=f'worker-{i}')
+        for i in range(max(1, SCAN_WORKERS))
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Arret du worker, fin des jobs en cours...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        shutdown_parse_pool()
 
 
 def run_scan():
-    """Lance un scan complet de tous les sites actives."""
+    """Coordonne un scan complet des sites actives.
+
+    Un job par site est ajoute a la file scan_jobs ; SCAN_WORKERS threads de
+    ce processus la traitent, avec les eventuels workers externes, la
+    politesse etant appliquee par hote dans la couche fetch. Les resultats
+    sont agreges dans scan_log au fur et a mesure que les sites terminent,
+    dans un ordre quelconque. Les scans par site mis en attente pendant ce
+    scan sont lances a la fin (run_site_scan).
+    """
     global last_scan_info
 
     with scan_lock:
@@ -951,6 +2613,35 @@ def run_scan():
             return
         last_scan_info['running'] = True
 
+    # Un seul scan par cluster : bail 'scan' partage par tous les workers, pris
+    # seulement si aucun scan par site ('scan:<slug>') n'est en cours
+    site_scans = []
+    try:
+        with writer_db() as conn:
+            site_scans = active_site_leases(conn)
+        acquired = not site_scans and acquire_lease('scan')
+    except sqlite3.Error as e:
+        logger.error(f"Bail de scan indisponible: {e}")
+        acquired = False
+    if not acquired:
+        # Le bail a pu etre pris par api_trigger_scan : il est rendu tout de suite
+        try:
+            release_lease('scan')
+        except sqlite3.Error:
+            pass
+        with scan_lock:
+            last_scan_info['running'] = False
+        if site_scans:
+            logger.warning(f"Scan par site en cours ({', '.join(row['name'] for row in site_scans)}), abandon")
+        else:
+            logger.warning("Scan en cours sur un autre worker, abandon")
+        return
+    # Bail perdu (expire, repris ailleurs) : le scan s'arrete au lieu de
+    # continuer en parallele du nouveau detenteur
+    lease_lost = threading.Event()
+    stop_heartbeat = start_heartbeat("bail 'scan'", lambda: renew_lease('scan'),
+                                     lambda: release_lease('scan'), on_lost=lease_lost.set)
+
     last_scan_info['started_at'] = datetime.now().isoformat()
     last_scan_info['results'] = {}
     last_scan_info['sites_done'] = 0
@@ -960,116 +2651,647 @@ def run_scan():
     broadcast_event('scan:started', {
         'started_at': last_scan_info['started_at'],
     })
-    conn = get_standalone_db()
-
-    # Inserer un enregistrement de scan en cours (finished_at=NULL = running)
-    cursor = conn.execute(
-        "INSERT INTO scan_log (started_at, finished_at, results) VALUES (?, NULL, NULL)",
-        (last_scan_info['started_at'],)
-    )
-    scan_log_id = cursor.lastrowid
-    conn.commit()
-
+    scan_log_id = None
     try:
-        sites = conn.execute("SELECT * FROM sites WHERE enabled = 1").fetchall()
+        # Inserer un enregistrement de scan en cours (finished_at=NULL = running) ;
+        # avec le bail, tout autre scan encore ouvert est un scan interrompu
+        with writer_db() as conn:
+            close_interrupted_scans(conn)
+            cursor = conn.execute(
+                "INSERT INTO scan_log (started_at, finished_at, results) VALUES (?, NULL, NULL)",
+                (last_scan_info['started_at'],)
+            )
+            scan_log_id = cursor.lastrowid
+            conn.commit()
+
+        with writer_db() as conn:
+            sites = conn.execute("SELECT * FROM sites WHERE enabled = 1").fetchall()
         last_scan_info['sites_total'] = len(sites)
 
+        scannable = []
         for site in sites:
-            site_slug = site['slug']
-            scraper_fn = SCRAPER_REGISTRY.get(site_slug)
-
-            if not scraper_fn:
-                logger.warning(f"Pas de scraper pour {site_slug}")
-                last_scan_info['results'][site_slug] = {'status': 'no_scraper', 'count': 0}
-                continue
-
-            logger.info(f"Scan de {site['name']}...")
-            site_products = []
-            search_urls = json.loads(site['search_urls']) if site['search_urls'] else []
-
-            for url in search_urls:
-                try:
-                    found = scraper_fn(url)
-                    site_products.extend(found)
-                    logger.info(f"  {url} -> {len(found)} produits")
-                    time.sleep(2)
-                except Exception as e:
-                    logger.error(f"  Erreur sur {url}: {e}")
-
-            displays = [p for p in site_products if is_french_display(p['name'])]
-            logger.info(f"  {len(displays)}/{len(site_products)} sont des displays FR")
-
-            # Marquer le debut du scan pour ce site (format SQLite pour comparaison)
-            scan_start = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            saved = 0
-            for product in displays:
-                try:
-                    save_product(conn, site['id'], product)
-                    saved += 1
-                except Exception as e:
-                    logger.error(f"  Erreur sauvegarde: {e}")
-
-            # Nettoyage : supprimer les produits de ce site non vus dans ce scan
-            stale = conn.execute(
-                "SELECT id FROM products WHERE site_id = ? AND last_seen < ?",
-                (site['id'], scan_start)
-            ).fetchall()
-            if stale:
-                stale_ids = [row['id'] for row in stale]
-                placeholders = ','.join('?' * len(stale_ids))
-                conn.execute(
-                    f"DELETE FROM price_history WHERE product_id IN ({placeholders})",
-                    stale_ids
-                )
-                conn.execute(
-                    f"DELETE FROM products WHERE id IN ({placeholders})",
-                    stale_ids
+            if get_scraper(site):
+                scannable.append(site)
+            else:
+                logger.warning(f"Pas de scraper pour {site['slug']}")
+                last_scan_info['results'][site['slug']] = {'status': 'no_scraper', 'count': 0}
+        last_scan_info['sites_done'] = len(last_scan_info['results'])
+
+        with writer_db() as conn:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO scan_jobs (scan_id, site_id) VALUES (?, ?)",
+                    [(scan_log_id, site['id']) for site in scannable]
                 )
-                conn.commit()
-                logger.info(f"  Nettoyage: {len(stale_ids)} produit(s) obsolete(s) supprime(s)")
 
-            last_scan_info['results'][site_slug] = {
-                'status': 'ok', 'count': saved, 'total_found': len(site_products),
-                'displays_fr': len(displays),
-            }
-            last_scan_info['sites_done'] = len(last_scan_info['results'])
-            logger.info(f"  {site['name']}: {saved} sauvegardes ({len(displays)} displays FR / {len(site_products)} total)")
-            broadcast_event('scan:progress', {
-                'site_name': site['name'],
-                'sites_done': last_scan_info['sites_done'],
-                'sites_total': last_scan_info['sites_total'],
-                'products_found': saved,
-            })
+        # Les threads locaux traitent les jobs de ce scan, en concurrence avec
+        # les workers externes (`python app.py worker`) s'il y en a
+        stop_workers = threading.Event()
+        workers = [
+            threading.Thread(target=queue_worker, args=(stop_workers, scan_log_id),
+                             daemon=True, name=f'scan-{i}')
+            for i in range(max(1, min(SCAN_WORKERS, len(scannable))))
+        ]
+        for worker in workers:
+            worker.start()
+        completed = False
+        try:
+            completed = wait_for_scan_jobs(scan_log_id, abort=lease_lost)
+        finally:
+            stop_workers.set()
+            # Apres un depassement, un thread bloque sur un site ne retient
+            # pas le bail : son resultat sera ignore (job deja clos)
+            for worker in workers:
+                worker.join(None if completed else 1)
 
         finished_at = datetime.now().isoformat()
-        conn.execute(
-            "UPDATE scan_log SET finished_at = ?, results = ? WHERE id = ?",
-            (finished_at, json.dumps(last_scan_info['results']), scan_log_id)
-        )
-        conn.commit()
+        with writer_db() as conn:
+            conn.execute(
+                "UPDATE scan_log SET finished_at = ?, results = ? WHERE id = ?",
+                (finished_at, json.dumps(last_scan_info['results']), scan_log_id)
+            )
+            conn.commit()
 
     except Exception as e:
         logger.error(f"Erreur scan: {e}")
         # Marquer le scan comme termine meme en cas d'erreur
         try:
-            conn.execute(
-                "UPDATE scan_log SET finished_at = ?, results = ? WHERE id = ?",
-                (datetime.now().isoformat(), json.dumps(last_scan_info['results']), scan_log_id)
-            )
-            conn.commit()
+            if scan_log_id is not None:
+                with writer_db() as conn:
+                    conn.rollback()
+                    conn.execute(
+                        "UPDATE scan_log SET finished_at = ?, results = ? WHERE id = ?",
+                        (datetime.now().isoformat(), json.dumps(last_scan_info['results']), scan_log_id)
+                    )
+                    conn.commit()
         except Exception:
             pass
     finally:
-        conn.close()
+        stop_heartbeat()
+        http_stats = http_pool_stats()
+        logger.info(
+            f"HTTP: {http_stats['requests']} requetes, {http_stats['connections']} connexions "
+            f"ouvertes, {http_stats['reused']} reutilisees (cumul depuis le demarrage)"
+        )
         with scan_lock:
             last_scan_info['running'] = False
+            # Sites en attente deja couverts par ce scan : inutile de les relancer
+            _pending_scan_sites.difference_update(last_scan_info['results'])
+        bump_scan_generation()
         last_scan_info['finished_at'] = datetime.now().isoformat()
         broadcast_event('scan:completed', {
             'finished_at': last_scan_info['finished_at'],
             'results': last_scan_info['results'],
         })
         logger.info("=== Fin du scan ===")
+        if SCAN_ADAPTIVE and scheduler_leader['active']:
+            try:
+                schedule_site_scans()
+            except sqlite3.Error as e:
+                logger.error(f"Erreur planification des scans: {e}")
+        start_pending_site_scans()
+
+
+def start_pending_site_scans():
+    """Lance les scans par site mis en attente pendant un scan complet."""
+    with scan_lock:
+        pending = sorted(_pending_scan_sites)
+        _pending_scan_sites.clear()
+    for slug in pending:
+        threading.Thread(target=run_site_scan, args=(slug,), daemon=True,
+                         name=f'site-{slug}').start()
+
+
+def run_site_scan(slug):
+    """Scan leger d'un seul site, declenche par son job planifie (scan adaptatif).
+
+    Sous le bail 'scan:<slug>', une ligne scan_log (site_id renseigne) et un
+    job sont crees : le job est traite par un thread de ce processus ou par
+    un worker externe, comme ceux d'un scan complet. Pas d'evenements
+    scan:started / scan:progress / scan:completed ni de contournement du
+    cache ; le cooldown des scans manuels ne voit que les scans complets.
+    Pendant un scan complet (ici ou sur un autre worker), le site est mis en
+    attente et relance a la fin de ce scan. Le cache des reponses et les
+    clients SSE ('site:updated') ne sont notifies que si les donnees ont
+    change.
+    """
+    with scan_lock:
+        if slug in _site_scans_running:
+            return
+        if last_scan_info['running']:
+            _pending_scan_sites.add(slug)
+            logger.info(f"Scan en cours, {slug} en attente")
+            return
+        _site_scans_running.add(slug)
+
+    lease = f'scan:{slug}'
+    try:
+        try:
+            with writer_db() as conn:
+                full_scan = active_lease(conn, 'scan')
+            if full_scan is not None:
+                with scan_lock:
+                    _pending_scan_sites.add(slug)
+                logger.info(f"Scan en cours sur {full_scan['holder']}, {slug} en attente")
+                return
+            if not acquire_lease(lease):
+                logger.info(f"{slug} deja en cours de scan sur un autre worker")
+                return
+        except sqlite3.Error as e:
+            logger.error(f"Bail de scan de {slug} indisponible: {e}")
+            with scan_lock:
+                _pending_scan_sites.add(slug)
+            return
+
+        lease_lost = threading.Event()
+        stop_heartbeat = start_heartbeat(f"bail '{lease}'", lambda: renew_lease(lease),
+                                         lambda: release_lease(lease), on_lost=lease_lost.set)
+        started = time.perf_counter()
+        site, scan_id, changed = None, None, False
+        result = {'status': 'error', 'count': 0}
+        try:
+            with writer_db() as conn:
+                site = conn.execute(
+                    "SELECT * FROM sites WHERE slug = ? AND enabled = 1", (slug,)
+                ).fetchone()
+                if site is None or get_scraper(site) is None:
+                    return
+                version = data_version(conn)
+                with conn:
+                    scan_id = conn.execute(
+                        "INSERT INTO scan_log (started_at, site_id) VALUES (?, ?)",
+                        (datetime.now().isoformat(), site['id'])
+                    ).lastrowid
+                    conn.execute(
+                        "INSERT INTO scan_jobs (scan_id, site_id) VALUES (?, ?)",
+                        (scan_id, site['id'])
+                    )
+
+            stop_worker = threading.Event()
+            worker = threading.Thread(target=queue_worker, args=(stop_worker, scan_id),
+                                      daemon=True, name=f'site-{slug}-job')
+            worker.start()
+            completed = False
+            try:
+                completed = wait_for_scan_jobs(scan_id, abort=lease_lost, report=False)
+            finally:
+                stop_worker.set()
+                worker.join(None if completed else 1)
+
+            with writer_db() as conn:
+                with conn:
+                    result = scan_job_results(conn, scan_id).get(slug, result)
+                    conn.execute(
+                        "UPDATE scan_log SET finished_at = ?, results = ? WHERE id = ?",
+                        (datetime.now().isoformat(), json.dumps({slug: result}), scan_id)
+                    )
+                changed = data_version(conn) != version
+        except Exception as e:
+            logger.error(f"  Erreur sur {site['name'] if site else slug}: {e}")
+            if scan_id is not None:
+                try:
+                    with writer_db() as conn:
+                        with conn:
+                            conn.execute(
+                                "UPDATE scan_log SET finished_at = ?, results = ? "
+                                "WHERE id = ? AND finished_at IS NULL",
+                                (datetime.now().isoformat(), json.dumps({slug: result}), scan_id)
+                            )
+                except sqlite3.Error:
+                    pass
+        finally:
+            stop_heartbeat()
+    finally:
+        with scan_lock:
+            _site_scans_running.discard(slug)
+
+    _site_runs[slug] = {
+        'finished_at': datetime.now().isoformat(), 'status': result['status'],
+        'count': result['count'], 'changed': changed,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    if changed:
+        bump_scan_generation()
+        broadcast_event('site:updated', {
+            'site_name': site['name'], 'products_found': result['count'],
+        })
+        if SCAN_ADAPTIVE and scheduler_leader['active']:
+            try:
+                schedule_site_scans()
+            except sqlite3.Error as e:
+                logger.error(f"Erreur planification des scans: {e}")
+
+
+# ============================================================
+# SURVEILLANCE DES REASSORTS
+# ============================================================
+
+# Entre deux scans, les fiches des produits "chauds" (precommandes, ruptures
+# recentes) sont relues a intervalle court. Seul l'etat prix / stock /
+# precommande est extrait de la fiche ; le reste vient de la table products.
+
+# Resultat de la derniere passe (expose par /api/metrics)
+last_restock_watch_info = {}
+
+_JSONLD_RE = re.compile(
+    r'<script[^>]+application/ld\+json[^>]*>(.*?)</script>', re.IGNORECASE | re.DOTALL)
+_MICRODATA_AVAILABILITY_RE = re.compile(r'schema\.org/(InStock|OutOfStock|SoldOut|PreOrder|PreSale|'
+                                        r'LimitedAvailability|BackOrder|Discontinued)\b')
+_MICRODATA_PRICE_RE = re.compile(
+    r'itemprop\s*=\s*["\']price["\'][^>]*content\s*=\s*["\']([\d.,]+)', re.IGNORECASE)
+IN_STOCK_AVAILABILITIES = ('InStock', 'LimitedAvailability', 'OnlineOnly', 'InStoreOnly')
+# WooCommerce publie 'onbackorder' (precommande dans les listings) en BackOrder
+PREORDER_AVAILABILITIES = ('PreOrder', 'PreSale', 'BackOrder')
+OUT_OF_STOCK_AVAILABILITIES = ('OutOfStock', 'SoldOut', 'Discontinued')
+
+
+def jsonld_offers(node):
+    """Offres (dicts schema.org Offer) des produits d'un bloc JSON-LD."""
+    if isinstance(node, list):
+        return [offer for item in node for offer in jsonld_offers(item)]
+    if not isinstance(node, dict):
+        return []
+    if '@graph' in node:
+        return jsonld_offers(node['@graph'])
+    node_type = node.get('@type')
+    types = node_type if isinstance(node_type, list) else [node_type]
+    if 'Product' not in types and 'ProductGroup' not in types:
+        return []
+    offers = []
+    for offer in (node.get('offers') or []) if isinstance(node.get('offers'), list) else [node.get('offers')]:
+        if isinstance(offer, dict):
+            # AggregateOffer : offres detaillees si presentes
+            offers.extend(offer['offers'] if isinstance(offer.get('offers'), list) else [offer])
+    return offers + jsonld_offers(node.get('hasVariant') or [])
+
+
+def parse_product_page(html):
+    """Etat (prix, stock, precommande) d'une fiche produit HTML, ou None.
+
+    Lit les offres JSON-LD (schema.org Product), a defaut les microdonnees
+    schema.org (availability / price). None si la fiche n'expose rien ;
+    'preorder' vaut None si aucune disponibilite connue n'est indiquee
+    (l'indicateur du listing est alors conserve).
+    """
+    offers = []
+    for block in _JSONLD_RE.findall(html):
+        try:
+            offers.extend(jsonld_offers(json.loads(block)))
+        except ValueError:
+            continue
+
+    states = []
+    for offer in offers:
+        availability = str(offer.get('availability', '')).rsplit('/', 1)[-1]
+        price = offer.get('price', offer.get('lowPrice'))
+        states.append((availability, parse_price(str(price)) if price is not None else None))
+    if not states:
+        availabilities = _MICRODATA_AVAILABILITY_RE.findall(html)
+        if not availabilities:
+            return None
+        price = _MICRODATA_PRICE_RE.search(html)
+        states = [(availabilities[0], parse_price(price.group(1)) if price else None)]
+
+    in_stock = [price for availability, price in states if availability in IN_STOCK_AVAILABILITIES]
+    prices = [price for price in (in_stock or [price for _, price in states]) if price]
+    known = IN_STOCK_AVAILABILITIES + PREORDER_AVAILABILITIES + OUT_OF_STOCK_AVAILABILITIES
+    preorder = None
+    if any(availability in known for availability, _ in states):
+        preorder = any(availability in PREORDER_AVAILABILITIES for availability, _ in states)
+    return {
+        'price': min(prices) if prices else None,
+        'in_stock': bool(in_stock),
+        'preorder': preorder,
+    }
+
+
+def fetch_product_page_state(url):
+    """Extracteur generique : fiche produit HTML (JSON-LD / microdonnees)."""
+    html = fetch_page(url)
+    return parse_product_page(html) if html else None
+
+
+def fetch_shopify_product_state(url):
+    """Extracteur Shopify : /products/<handle>.js (prix en centimes, tous les variants)."""
+    data = fetch_json(url.rstrip('/') + '.js')
+    if not data:
+        return None
+    variants = data.get('variants') or []
+    available = [v for v in variants if v.get('available')]
+    prices = [v['price'] / 100 for v in (available or variants) if v.get('price')]
+    return {
+        'price': min(prices) if prices else None,
+        'in_stock': bool(available),
+        'preorder': False,
+    }
+
+
+# Extracteurs de fiche produit : slug -> fonction(url) -> etat ou None
+PRODUCT_EXTRACTORS = {
+    'relictcg': fetch_shopify_product_state,
+}
+
+
+def get_product_extractor(site):
+    """Extracteur d'un site : registre, Shopify si scrape_shopify, sinon generique."""
+    extractor = PRODUCT_EXTRACTORS.get(site['slug'])
+    if extractor:
+        return extractor
+    if get_scraper(site) is scrape_shopify:
+        return fetch_shopify_product_state
+    return fetch_product_page_state
+
+
+def load_watchlist(conn):
+    """Produits a surveiller : precommandes et produits passes en rupture recemment.
+
+    Les produits en rupture passent en premier, puis les plus recents ;
+    au plus RESTOCK_WATCH_SIZE produits.
+    """
+    return conn.execute(
+        """SELECT p.id, p.site_id, p.name, p.url, p.set_code, p.image_url,
+                  s.slug, s.name AS site_name, s.search_urls,
+                  pl.price, pl.in_stock, pl.preorder
+           FROM products p
+           JOIN product_latest pl ON pl.product_id = p.id
+           JOIN sites s ON s.id = p.site_id
+           WHERE s.enabled = 1 AND (pl.preorder = 1 OR (pl.in_stock = 0 AND EXISTS (
+               SELECT 1 FROM price_history ph
+               WHERE ph.product_id = p.id AND ph.in_stock = 1
+                 AND COALESCE(ph.last_confirmed_at, ph.checked_at) >= datetime('now', ?))))
+           ORDER BY pl.in_stock, p.id DESC
+           LIMIT ?""",
+        (f'-{RESTOCK_WATCH_HOURS} hours', RESTOCK_WATCH_SIZE)
+    ).fetchall()
+
+
+def run_restock_watch():
+    """Relit les fiches de la liste surveillee et enregistre les changements.
+
+    Les fiches sont recuperees en parallele par le client partage (politesse
+    par hote incluse). Un produit dont le prix, le stock ou la precommande a
+    change est enregistre (historique, etat courant et agregats) puis est
+    diffuse aux clients SSE ('product:update'). Passe sautee pendant un scan,
+    complet ou par site, sur n'importe quel worker (bails 'scan' et
+    'scan:<slug>') : le scan couvre deja ces produits et le trafic vers les
+    memes hotes ne serait que double.
+    """
+    if last_scan_info['running']:
+        return
+    started = time.perf_counter()
+    with writer_db() as conn:
+        if active_lease(conn, 'scan') or active_site_leases(conn):
+            return
+        watchlist = load_watchlist(conn)
+    if not watchlist:
+        return
+
+    workers = max(1, min(SCAN_WORKERS, len(watchlist)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='watch') as executor:
+        futures = {
+            executor.submit(get_product_extractor(product), product['url']): product
+            for product in watchlist
+        }
+        states = []
+        for future in as_completed(futures):
+            product = futures[future]
+            try:
+                state = future.result()
+            except Exception as e:
+                logger.error(f"Surveillance {product['url']}: {e}")
+                continue
+            if state is not None:
+                states.append((product, state))
+
+    changes = []
+    for product, state in states:
+        price = state['price'] if state['price'] is not None else product['price']
+        preorder = product['preorder'] if state['preorder'] is None else int(state['preorder'])
+        if (price, int(state['in_stock']), preorder) == \
+                (product['price'], product['in_stock'], product['preorder']):
+            continue
+        with writer_db() as conn, conn:
+            checked_at = conn.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+            save_products(conn, product['site_id'], [{
+                'name': product['name'], 'url': product['url'],
+                'set_code': product['set_code'], 'image_url': product['image_url'],
+                'price': price, 'in_stock': state['in_stock'], 'preorder': preorder,
+            }])
+            # Agregats alignes sur product_latest, comme apres un scan
+            update_rollups(conn, product['site_id'], checked_at, [product['id']])
+        changes.append({
+            'product_id': product['id'], 'name': product['name'], 'url': product['url'],
+            'site_name': product['site_name'], 'price': price,
+            'in_stock': bool(state['in_stock']), 'preorder': bool(preorder),
+            'restock': bool(state['in_stock']) and not product['in_stock'],
+        })
+
+    if changes:
+        bump_scan_generation()
+        for change in changes:
+            logger.info(
+                f"Surveillance: {change['name']} ({change['site_name']}) "
+                f"{'REASSORT' if change['restock'] else 'modifie'} - {change['price']} EUR"
+            )
+            broadcast_event('product:update', change)
+
+    last_restock_watch_info.update({
+        'at': datetime.now().isoformat(), 'watched': len(watchlist),
+        'checked': len(states), 'changed': len(changes),
+        'restocks': sum(1 for change in changes if change['restock']),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+    })
+
+
+# ============================================================
+# MAINTENANCE
+# ============================================================
+
+# Resultat de la derniere maintenance (expose par /api/metrics)
+last_maintenance_info = {}
+# Conservation des jobs de scan termines (jours)
+SCAN_JOBS_RETENTION_DAYS = 7
+
+
+def delete_in_chunks(table, where, params, key='id'):
+    """Supprime par lots de MAINTENANCE_CHUNK_SIZE lignes, une transaction par lot.
+
+    `key` est la cle (eventuellement composite, ex: 'product_id, bucket')
+    identifiant les lignes de `table`.
+
+    L'ecrivain n'est tenu que le temps d'un lot ; entre deux lots la
+    maintenance s'efface si un scan demarre dans ce worker, afin de ne
+    jamais bloquer un scan.
+    """
+    deleted = 0
+    while True:
+        with writer_db() as conn, conn:
+            count = conn.execute(
+                f"DELETE FROM {table} WHERE ({key}) IN "
+                f"(SELECT {key} FROM {table} WHERE {where} LIMIT ?)",
+                (*params, MAINTENANCE_CHUNK_SIZE)
+            ).rowcount
+        deleted += count
+        if count < MAINTENANCE_CHUNK_SIZE:
+            return deleted
+        while last_scan_info['running']:
+            time.sleep(5)
+        time.sleep(0.05)
+
+
+def compact_price_history():
+    """Fusionne les lignes consecutives identiques (historique 'full') en une seule.
+
+    La premiere ligne de chaque serie est conservee et son last_confirmed_at
+    prolonge jusqu'a la fin de la serie ; product_latest est repointe.
+    Traitement par plages de product_id d'environ MAINTENANCE_CHUNK_SIZE
+    lignes, une transaction par plage : comme pour delete_in_chunks,
+    l'ecrivain est libere entre deux plages et la compaction s'efface
+    pendant un scan.
+    """
+    merged = 0
+    last_product_id = 0
+    while True:
+        with writer_db() as conn, conn:
+            # Borne haute de la plage : product_id de la N-ieme ligne suivante
+            # (parcours de l'index idx_history_product)
+            bound = conn.execute(
+                """SELECT product_id FROM price_history WHERE product_id > ?
+                   ORDER BY product_id LIMIT 1 OFFSET ?""",
+                (last_product_id, MAINTENANCE_CHUNK_SIZE)
+            ).fetchone()
+            upper = bound[0] if bound else sys.maxsize
+            conn.execute("DROP TABLE IF EXISTS temp.history_compaction")
+            conn.execute("""
+                CREATE TEMP TABLE history_compaction AS
+                WITH flagged AS (
+                    SELECT id, product_id, checked_at,
+                           COALESCE(last_confirmed_at, checked_at) AS confirmed_at,
+                           CASE WHEN LAG(id) OVER w IS NOT NULL
+                                 AND price IS LAG(price) OVER w
+                                 AND in_stock IS LAG(in_stock) OVER w
+                                 AND preorder IS LAG(preorder) OVER w
+                                THEN 0 ELSE 1 END AS run_start
+                    FROM price_history
+                    WHERE product_id > ? AND product_id <= ?
+                    WINDOW w AS (PARTITION BY product_id ORDER BY checked_at, id)
+                ), runs AS (
+                    SELECT id, product_id, confirmed_at, run_start,
+                           SUM(run_start) OVER (PARTITION BY product_id ORDER BY checked_at, id) AS run
+                    FROM flagged
+                )
+                SELECT r.id, h.head_id, h.run_end
+                FROM runs r
+                JOIN (
+                    SELECT product_id, run, MIN(CASE WHEN run_start = 1 THEN id END) AS head_id,
+                           MAX(confirmed_at) AS run_end, COUNT(*) AS size
+                    FROM runs GROUP BY product_id, run
+                ) h ON h.product_id = r.product_id AND h.run = r.run
+                WHERE h.size > 1
+            """, (last_product_id, upper))
+            conn.execute("""
+                UPDATE price_history SET last_confirmed_at = (
+                    SELECT run_end FROM history_compaction c WHERE c.id = price_history.id
+                )
+                WHERE id IN (SELECT head_id FROM history_compaction)
+            """)
+            conn.execute("""
+                UPDATE product_latest SET history_id = (
+                    SELECT head_id FROM history_compaction c WHERE c.id = product_latest.history_id
+                )
+                WHERE history_id IN (SELECT id FROM history_compaction WHERE id != head_id)
+            """)
+            merged += conn.execute("""
+                DELETE FROM price_history
+                WHERE id IN (SELECT id FROM history_compaction WHERE id != head_id)
+            """).rowcount
+            conn.execute("DROP TABLE temp.history_compaction")
+        if bound is None:
+            return merged
+        last_product_id = upper
+        while last_scan_info['running']:
+            time.sleep(5)
+        time.sleep(0.05)
+
+
+def run_maintenance():
+    """Retention et compaction de l'historique, puis vacuum incremental."""
+    started = time.perf_counter()
+    try:
+        with writer_db() as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+        merged = 0
+        if HISTORY_MODE == 'changes':
+            merged = compact_price_history()
+
+        raw_deleted = 0
+        if RAW_HISTORY_RETENTION_DAYS > 0:
+            # La ligne courante de chaque produit est toujours conservee
+            raw_deleted = delete_in_chunks(
+                'price_history',
+                "COALESCE(last_confirmed_at, checked_at) < datetime('now', ?) "
+                "AND id NOT IN (SELECT history_id FROM product_latest WHERE history_id IS NOT NULL)",
+                (f'-{RAW_HISTORY_RETENTION_DAYS} days',)
+            )
+
+        hourly_deleted = 0
+        if HOURLY_ROLLUP_RETENTION_DAYS > 0:
+            hourly_deleted = delete_in_chunks(
+                'price_rollup_hourly',
+                "bucket < datetime('now', ?)",
+                (f'-{HOURLY_ROLLUP_RETENTION_DAYS} days',),
+                key='product_id, bucket'
+            )
+
+        # Jobs de scan termines : seuls les resultats agreges de scan_log restent utiles
+        jobs_deleted = delete_in_chunks(
+            'scan_jobs',
+            "status IN ('done', 'failed') AND created_at < datetime('now', ?)",
+            (f'-{SCAN_JOBS_RETENTION_DAYS} days',)
+        )
+        # Scans par site : plusieurs par heure et par site, gardes aussi
+        # longtemps que leurs jobs (les scans complets sont conserves)
+        site_scans_deleted = delete_in_chunks(
+            'scan_log',
+            "site_id IS NOT NULL AND finished_at < ? "
+            "AND NOT EXISTS (SELECT 1 FROM scan_jobs j WHERE j.scan_id = scan_log.id)",
+            ((datetime.now() - timedelta(days=SCAN_JOBS_RETENTION_DAYS)).isoformat(),)
+        )
+
+        # Rendre les pages liberees au systeme, par petites etapes
+        if auto_vacuum == 2:
+            while True:
+                with writer_db() as conn:
+                    if conn.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                        break
+                    conn.execute("PRAGMA incremental_vacuum(1000)").fetchall()
+            # Reporter le contenu du WAL dans la base pour que le fichier retrecisse
+            with writer_db() as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+        with writer_db() as conn:
+            pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+        last_maintenance_info.update({
+            'finished_at': datetime.now().isoformat(),
+            'duration_s': round(time.perf_counter() - started, 2),
+            'compacted_rows': merged,
+            'raw_rows_deleted': raw_deleted,
+            'hourly_rollups_deleted': hourly_deleted,
+            'scan_jobs_deleted': jobs_deleted,
+            'site_scans_deleted': site_scans_deleted,
+            'bytes_reclaimed': max(0, pages_before - pages_after) * page_size,
+        })
+        logger.info(
+            f"Maintenance: {merged} ligne(s) compactee(s), {raw_deleted} ligne(s) brute(s) "
+            f"et {hourly_deleted} agregat(s) horaire(s) supprime(s), "
+            f"{last_maintenance_info['bytes_reclaimed']} octets recuperes "
+            f"en {last_maintenance_info['duration_s']} s"
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Erreur maintenance: {e}")
 
 
 # ============================================================
@@ -1078,9 +3300,238 @@ def run_scan():
 
 scheduler = BackgroundScheduler(daemon=True)
 
+# Scans par site : un releve sur SCAN_POLLS_PER_CHANGE par changement attendu
+SCAN_POLLS_PER_CHANGE = 4
+# Intervalle courant de chaque job de scan : slug -> {interval_minutes, reason}
+_site_schedules = {}
+
+
+def compute_scan_intervals(conn):
+    """Intervalle de scan (minutes) et raison, par slug de site active.
+
+    - 'preorder' : le site propose un set en precommande quelque part
+      (sortie imminente, reassorts probables) -> SCAN_MIN_INTERVAL ;
+    - 'new' : site sans produit connu -> SCAN_INTERVAL ;
+    - 'changes' : temps moyen entre deux changements (prix, stock,
+      precommande ou nouveau produit) sur SCAN_CHANGE_WINDOW_DAYS jours,
+      divise par SCAN_POLLS_PER_CHANGE et borne par SCAN_MIN/MAX_INTERVAL.
+    """
+    # Seuls les releves de la fenetre sont lus (index sur checked_at) ; le
+    # premier releve de chaque produit dans la fenetre est compare au releve
+    # precedent, lu par l'index product_id (absent : nouveau produit)
+    changes = {
+        row['site_id']: row['changes'] for row in conn.execute(
+            """WITH h AS (
+                   SELECT ph.id, ph.product_id, ph.price, ph.in_stock, ph.preorder,
+                          LAG(ph.id) OVER w AS prev_id,
+                          LAG(ph.price) OVER w AS prev_price,
+                          LAG(ph.in_stock) OVER w AS prev_in_stock,
+                          LAG(ph.preorder) OVER w AS prev_preorder
+                   FROM price_history ph
+                   WHERE ph.checked_at >= datetime('now', ?)
+                   WINDOW w AS (PARTITION BY ph.product_id ORDER BY ph.id)
+               )
+               SELECT p.site_id, COUNT(*) AS changes
+               FROM h JOIN products p ON p.id = h.product_id
+               WHERE CASE WHEN h.prev_id IS NOT NULL
+                          THEN h.price IS NOT h.prev_price OR h.in_stock IS NOT h.prev_in_stock
+                               OR h.preorder IS NOT h.prev_preorder
+                          ELSE NOT EXISTS (
+                              SELECT 1 FROM price_history o
+                              WHERE o.id = (SELECT MAX(id) FROM price_history
+                                            WHERE product_id = h.product_id AND id < h.id)
+                                AND o.price IS h.price AND o.in_stock IS h.in_stock
+                                AND o.preorder IS h.preorder)
+                     END
+               GROUP BY p.site_id""",
+            (f'-{SCAN_CHANGE_WINDOW_DAYS} days',)
+        )
+    }
+    known = {row[0] for row in conn.execute("SELECT DISTINCT site_id FROM products")}
+    boosted = {row[0] for row in conn.execute(
+        """SELECT DISTINCT p.site_id FROM products p
+           WHERE p.set_code IN (
+               SELECT p2.set_code FROM products p2
+               JOIN product_latest pl ON pl.product_id = p2.id
+               WHERE pl.preorder = 1 AND p2.set_code IS NOT NULL)"""
+    )}
+
+    window_minutes = SCAN_CHANGE_WINDOW_DAYS * 24 * 60
+    intervals = {}
+    for site in conn.execute("SELECT id, slug FROM sites WHERE enabled = 1"):
+        if site['id'] in boosted:
+            intervals[site['slug']] = (SCAN_MIN_INTERVAL, 'preorder')
+        elif site['id'] not in known:
+            intervals[site['slug']] = (SCAN_INTERVAL_MINUTES, 'new')
+        else:
+            count = changes.get(site['id'], 0)
+            minutes = window_minutes / (count * SCAN_POLLS_PER_CHANGE) if count else SCAN_MAX_INTERVAL
+            minutes = max(SCAN_MIN_INTERVAL, min(SCAN_MAX_INTERVAL, round(minutes)))
+            intervals[site['slug']] = (minutes, 'changes')
+    return intervals
+
+
+def schedule_site_scans():
+    """Cree, ajuste ou retire les jobs de scan par site selon leur intervalle.
+
+    Un nouveau job demarre a un instant aleatoire de son premier intervalle
+    et chaque declenchement est decale de +/- SCAN_JITTER_SECONDS, pour que
+    les sites ne partent pas tous en meme temps. Un job n'est replanifie que
+    si son intervalle change.
+    """
+    with writer_db() as conn:
+        intervals = compute_scan_intervals(conn)
+
+    for slug, (minutes, reason) in intervals.items():
+        job_id = f'scan_{slug}'
+        current = _site_schedules.get(slug)
+        _site_schedules[slug] = {'interval_minutes': minutes, 'reason': reason}
+        if current and current['interval_minutes'] == minutes and scheduler.get_job(job_id):
+            continue
+        if scheduler.get_job(job_id):
+            scheduler.reschedule_job(job_id, trigger='interval', minutes=minutes,
+                                     jitter=SCAN_JITTER_SECONDS)
+        else:
+            scheduler.add_job(
+                run_site_scan, 'interval', args=[slug],
+                minutes=minutes, jitter=SCAN_JITTER_SECONDS,
+                next_run_time=datetime.now() + timedelta(seconds=random.uniform(0, minutes * 60)),
+                id=job_id, replace_existing=True, max_instances=1,
+            )
+        logger.info(f"Scan de {slug} toutes les {minutes} min ({reason})")
+
+    for slug in set(_site_schedules) - set(intervals):
+        _site_schedules.pop(slug)
+        if scheduler.get_job(f'scan_{slug}'):
+            scheduler.remove_job(f'scan_{slug}')
+
+
+def scan_schedule_stats():
+    """Intervalle, raison, prochain declenchement et dernier resultat de chaque
+    job de scan par site."""
+    stats = {}
+    for slug, schedule in _site_schedules.items():
+        job = scheduler.get_job(f'scan_{slug}')
+        next_run = job.next_run_time.isoformat() if job and job.next_run_time else None
+        stats[slug] = dict(schedule, next_run=next_run, pending=slug in _pending_scan_sites,
+                           last_run=_site_runs.get(slug))
+    return stats
+
+
+# Leader du scheduler : seul le worker detenant le bail 'scheduler' porte les
+# jobs de scan, de surveillance et de maintenance
+scheduler_leader = {'active': False, 'since': None}
+
+
+def add_leader_jobs():
+    """Ajoute les jobs planifies (scans, surveillance, maintenance) au scheduler."""
+    if not SCAN_ADAPTIVE:
+        scheduler.add_job(
+            run_scan, 'interval',
+            minutes=SCAN_INTERVAL_MINUTES,
+            id='periodic_scan',
+            replace_existing=True,
+            max_instances=1,
+        )
+    if RESTOCK_WATCH_INTERVAL > 0:
+        scheduler.add_job(
+            run_restock_watch, 'interval',
+            seconds=RESTOCK_WATCH_INTERVAL,
+            id='restock_watch',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    scheduler.add_job(
+        run_maintenance, 'interval',
+        hours=MAINTENANCE_INTERVAL_HOURS,
+        id='maintenance',
+        replace_existing=True,
+        max_instances=1,
+    )
+    if SCAN_ADAPTIVE:
+        schedule_site_scans()
+        scan_mode = f"scan adaptatif par site ({SCAN_MIN_INTERVAL}-{SCAN_MAX_INTERVAL} min)"
+    else:
+        scan_mode = f"scan toutes les {SCAN_INTERVAL_MINUTES} min"
+    logger.info(
+        f"Leader du scheduler ({worker_id()}) - {scan_mode}, "
+        f"maintenance toutes les {MAINTENANCE_INTERVAL_HOURS} h"
+    )
+
+
+def remove_leader_jobs():
+    """Retire les jobs planifies : un autre worker est devenu leader."""
+    for job in scheduler.get_jobs():
+        if job.id != 'leadership':
+            scheduler.remove_job(job.id)
+    _site_schedules.clear()
+    with scan_lock:
+        _pending_scan_sites.clear()
+
+
+def leadership_tick():
+    """Job de chaque worker : prend ou renouvelle le bail 'scheduler'.
+
+    Le worker qui obtient le bail ajoute les jobs planifies, celui qui le
+    perd les retire. Le leader cloture aussi les scans interrompus (bail
+    'scan' expire alors que scan_log indique un scan en cours) et, une fois
+    le scan complet d'un autre worker termine, lance les scans par site mis
+    en attente.
+    """
+    try:
+        leader = acquire_lease('scheduler')
+    except sqlite3.Error as e:
+        logger.warning(f"Bail du scheduler indisponible: {e}")
+        return
+
+    if leader and not scheduler_leader['active']:
+        scheduler_leader.update(active=True, since=datetime.now().isoformat())
+        add_leader_jobs()
+    elif not leader and scheduler_leader['active']:
+        scheduler_leader.update(active=False, since=None)
+        remove_leader_jobs()
+        logger.warning("Bail du scheduler perdu, jobs planifies retires")
+
+    if leader and not last_scan_info['running']:
+        with writer_db() as conn:
+            with conn:
+                scan_active = active_lease(conn, 'scan') is not None
+                if not scan_active and close_interrupted_scans(conn):
+                    bump_scan_generation()
+        if not scan_active:
+            start_pending_site_scans()
+
+
+def shutdown_scheduler():
+    """Arrete le scheduler et libere le bail 'scheduler' pour un autre worker."""
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    if scheduler_leader['active']:
+        scheduler_leader.update(active=False, since=None)
+        try:
+            release_lease('scheduler')
+        except sqlite3.Error:
+            pass
+
+
+def lease_stats():
+    """Ce worker, son role de leader et les bails en cours de validite."""
+    conn = get_db()
+    leases = {}
+    for name in ('scheduler', 'scan'):
+        row = active_lease(conn, name)
+        leases[name] = dict(row) if row else None
+    return {'worker': worker_id(), 'leader': scheduler_leader['active'], 'leases': leases}
+
 
 def init_scheduler():
-    """Initialise le scheduler pour les scans periodiques."""
+    """Initialise le scheduler : election du leader puis jobs periodiques.
+
+    Chaque worker gunicorn demarre son scheduler, mais seul le leader (bail
+    'scheduler') execute les jobs planifies ; les autres ne font que tenter
+    de prendre le bail toutes les LEASE_TTL/3 secondes.
+    """
     if not DB_PATH.exists():
         logger.warning("Base de donnees absente, scheduler non demarre")
         return
@@ -1088,15 +3539,223 @@ def init_scheduler():
         return
 
     scheduler.add_job(
-        run_scan, 'interval',
-        minutes=SCAN_INTERVAL_MINUTES,
-        id='periodic_scan',
+        leadership_tick, 'interval',
+        seconds=LEASE_TTL / 3,
+        next_run_time=datetime.now(),
+        id='leadership',
         replace_existing=True,
         max_instances=1,
+        coalesce=True,
     )
     scheduler.start()
-    atexit.register(lambda: scheduler.shutdown(wait=False))
-    logger.info(f"Scheduler demarre - scan toutes les {SCAN_INTERVAL_MINUTES} min")
+    atexit.register(shutdown_scheduler)
+    logger.info(f"Scheduler demarre ({worker_id()}), election du leader")
+
+
+# ============================================================
+# CACHE ET COMPRESSION DES REPONSES API
+# ============================================================
+
+# Les donnees du dashboard ne changent qu'a la fin d'un scan : les reponses sont
+# mises en cache par (endpoint, parametres, generation). La generation combine
+# l'id du dernier scan complet dans scan_log et la version des donnees
+# (data_version), ce qui couvre aussi les scans par site, la surveillance et
+# les scans lances par un autre worker gunicorn. Pendant un scan complet, le
+# cache est contourne.
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+_response_cache_stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0, 'evictions': 0}
+_scan_generation = {'value': None, 'read_at': 0.0}
+
+
+def data_version(conn):
+    """Version des donnees : dernier releve de prix et compteur de data_changes.
+
+    Change a chaque nouveau releve (prix, stock, precommande) et a chaque
+    ajout, suppression ou modification (nom, image, set) d'un produit, via
+    les triggers sur products ; un scan qui ne fait que reconfirmer l'etat
+    courant la laisse inchangee.
+    """
+    row = conn.execute(
+        "SELECT (SELECT COALESCE(MAX(id), 0) FROM price_history), "
+        "(SELECT products FROM data_changes WHERE id = 1)"
+    ).fetchone()
+    return f'{row[0]}.{row[1]}'
+
+
+def bump_scan_generation():
+    """Force la relecture de la generation (apres un scan ou une surveillance)."""
+    with _response_cache_lock:
+        _scan_generation['read_at'] = 0.0
+
+
+def current_scan_generation():
+    """Generation courante des donnees, ou None si un scan est en cours."""
+    if last_scan_info['running']:
+        return None
+    with _response_cache_lock:
+        if time.monotonic() - _scan_generation['read_at'] < RESPONSE_CACHE_GENERATION_TTL:
+            return _scan_generation['value']
+
+    db = get_db()
+    row = db.execute(
+        "SELECT id, finished_at FROM scan_log WHERE site_id IS NULL ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    # Les ecritures hors scan complet (scans par site, surveillance des
+    # reassorts) sont couvertes par la version des donnees
+    version = data_version(db)
+    if row is None:
+        generation = f'0.{version}'
+    elif row['finished_at'] is None:
+        # Scan en cours sur un autre worker
+        generation = None
+    else:
+        generation = f"{row['id']}.{version}"
+
+    with _response_cache_lock:
+        if generation != _scan_generation['value']:
+            # Les entrees des generations precedentes ne serviront plus
+            _response_cache.clear()
+        _scan_generation.update(value=generation, read_at=time.monotonic())
+    return generation
+
+
+def negotiate_encoding():
+    """Encodage de compression accepte par le client (br, gzip) ou None."""
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(available)
+
+
+def compress_body(body, encoding):
+    """Compresse un corps de reponse avec l'encodage negocie."""
+    if encoding == 'br':
+        # Qualite brotli ~ niveau gzip (0-11 contre 1-9)
+        return brotli.compress(body, quality=min(11, COMPRESS_LEVEL + 1))
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+
+def response_etag(generation, encoding=None):
+    """ETag fort derive de la generation et de la requete (chemin + parametres).
+
+    Chaque encodage a son propre ETag : les octets envoyes different.
+    """
+    query = json.dumps([request.path, sorted(request.args.items(multi=True))])
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+    suffix = {'gzip': '-gz', 'br': '-br'}.get(encoding, '')
+    return f'g{generation}-{digest}{suffix}'
+
+
+def cached_response(view):
+    """Met en cache la reponse JSON d'un endpoint pour la generation courante.
+
+    La reponse porte un ETag fort : un client renvoyant le meme validateur
+    (If-None-Match) recoit un 304 sans que la requete de l'endpoint ne soit
+    executee ; seule la generation est relue en base, au plus toutes les
+    RESPONSE_CACHE_GENERATION_TTL secondes.
+    Les variantes compressees sont gardees dans l'entree du cache : chaque
+    corps est compresse une fois par generation et par encodage.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            generation = current_scan_generation()
+        except sqlite3.Error:
+            generation = None
+        if generation is None:
+            with _response_cache_lock:
+                _response_cache_stats['bypassed'] += 1
+            return view(*args, **kwargs)
+
+        # 304 seulement pour la variante que cette requete recevrait : encodage
+        # negocie, ou corps brut si la reponse est trop petite pour etre compressee
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), generation)
+        encoding = negotiate_encoding()
+        with _response_cache_lock:
+            cached = _response_cache.get(key)
+        variants = [encoding]
+        if encoding and cached is not None and len(cached['body']) < COMPRESS_MIN_SIZE:
+            variants = [None]
+        for variant in variants:
+            cached_etag = response_etag(generation, variant)
+            if cached_etag in request.if_none_match:
+                with _response_cache_lock:
+                    _response_cache_stats['not_modified'] += 1
+                response = Response(status=304)
+                response.set_etag(cached_etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                response.vary.add('Accept-Encoding')
+                return response
+
+        with _response_cache_lock:
+            entry = _response_cache.get(key)
+            if entry is not None:
+                _response_cache.move_to_end(key)
+                _response_cache_stats['hits'] += 1
+            else:
+                _response_cache_stats['misses'] += 1
+        if entry is not None:
+            response = Response(entry['body'], status=200, mimetype='application/json')
+            response.headers['X-Cache'] = 'HIT'
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            entry = {'body': response.get_data()}
+            with _response_cache_lock:
+                if RESPONSE_CACHE_SIZE > 0:
+                    _response_cache[key] = entry
+                while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                    _response_cache.popitem(last=False)
+                    _response_cache_stats['evictions'] += 1
+            response.headers['X-Cache'] = 'MISS'
+
+        if encoding and len(entry['body']) >= COMPRESS_MIN_SIZE:
+            compressed = entry.get(encoding)
+            if compressed is None:
+                compressed = entry[encoding] = compress_body(entry['body'], encoding)
+            response.set_data(compressed)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            encoding = None
+        response.vary.add('Accept-Encoding')
+        response.set_etag(response_etag(generation, encoding))
+        # Toujours revalider aupres du serveur (le 304 ne coute presque rien)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+
+@app.after_request
+def compress_response(response):
+    """Compresse les autres reponses JSON de l'API (hors cache de generation)."""
+    if (not request.path.startswith('/api/')
+            or response.status_code != 200
+            or response.mimetype != 'application/json'
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def response_cache_stats():
+    """Statistiques du cache de reponses (hits, misses, evictions)."""
+    with _response_cache_lock:
+        stats = dict(_response_cache_stats)
+        stats['entries'] = len(_response_cache)
+        stats['max_entries'] = RESPONSE_CACHE_SIZE
+        stats['generation'] = _scan_generation['value']
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0
+    return stats
 
 
 # ============================================================
@@ -1109,31 +3768,161 @@ def health():
     return jsonify({"status": "ok", "version": __version__}), 200
 
 
+def fts_match_query(search):
+    """Requete FTS5 : chaque mot saisi devient un prefixe ("mot"*), tous requis."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', search))
+
+
+def search_condition(search):
+    """Filtre SQL (et parametres) sur le nom des produits pour une recherche.
+
+    Index FTS5 si disponible, sinon LIKE '%terme%' (parcours complet).
+    """
+    match = fts_match_query(search) if PRODUCTS_FTS_ENABLED else ''
+    if match:
+        return "p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)", [match]
+    return "p.name LIKE ?", [f"%{search}%"]
+
+
+# Colonnes exposees par /api/products (parametre fields=) et leur expression SQL
+PRODUCT_FIELDS = {
+    'id': 'p.id',
+    'name': 'p.name',
+    'set_code': 'p.set_code',
+    'url': 'p.url',
+    'image_url': 'p.image_url',
+    'first_seen': 'p.first_seen',
+    'last_seen': 'p.last_seen',
+    'site_name': 's.name',
+    'site_slug': 's.slug',
+    'site_url': 's.url',
+    'price': 'pl.price',
+    'in_stock': 'pl.in_stock',
+    'checked_at': 'pl.checked_at',
+}
+
+# Cle de tri de chaque mode : (expression non NULL, sens). Le dernier element
+# (p.id) rend l'ordre total, ce qui permet la pagination par curseur (keyset).
+PRODUCT_SORT_KEYS = {
+    'price_asc': (
+        ('CASE WHEN pl.price IS NULL THEN 1 ELSE 0 END', 'ASC'),
+        ('COALESCE(pl.price, 0)', 'ASC'),
+        ('p.id', 'ASC'),
+    ),
+    'price_desc': (
+        ('CASE WHEN pl.price IS NULL THEN 1 ELSE 0 END', 'ASC'),
+        ('COALESCE(pl.price, 0)', 'DESC'),
+        ('p.id', 'ASC'),
+    ),
+    'name': (
+        ('p.name', 'ASC'),
+        ('p.id', 'ASC'),
+    ),
+    'recent': (
+        ('CASE WHEN pl.checked_at IS NULL THEN 1 ELSE 0 END', 'ASC'),
+        ("COALESCE(pl.checked_at, '')", 'DESC'),
+        ('p.id', 'DESC'),
+    ),
+    # Pertinence bm25 de la recherche plein texte (rank croissant = meilleur)
+    'relevance': (
+        ('products_fts.rank', 'ASC'),
+        ('p.id', 'ASC'),
+    ),
+}
+
+
+def encode_cursor(sort, values):
+    """Curseur opaque : position (valeurs de la cle de tri) apres la derniere ligne."""
+    raw = json.dumps([sort, list(values)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """Decode un curseur ; ValueError s'il est invalide ou d'un autre tri."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"curseur invalide: {e}")
+    if cursor_sort != sort or len(values) != len(PRODUCT_SORT_KEYS[sort]):
+        raise ValueError("curseur emis pour un autre tri")
+    if not all(isinstance(v, (str, int, float)) for v in values):
+        raise ValueError("valeurs de curseur invalides")
+    return values
+
+
+def keyset_condition(keys):
+    """Condition SQL 'apres la position du curseur' pour une cle de tri multi-colonnes."""
+    clauses = []
+    for i, (expr, direction) in enumerate(keys):
+        op = '>' if direction == 'ASC' else '<'
+        equal = [f"{prev} = ?" for prev, _ in keys[:i]]
+        clauses.append('(' + ' AND '.join(equal + [f"{expr} {op} ?"]) + ')')
+    return '(' + ' OR '.join(clauses) + ')'
+
+
+def keyset_params(values):
+    """Parametres de keyset_condition, dans l'ordre des clauses generees."""
+    params = []
+    for i in range(len(values)):
+        params.extend(values[:i + 1])
+    return params
+
+
 @app.route('/api/products')
 def api_products():
-    """Liste des produits avec filtres optionnels."""
+    """Liste paginee des produits avec filtres optionnels.
+
+    Pagination par curseur (keyset) : le corps reste un tableau JSON, le
+    curseur de la page suivante est renvoye dans l'en-tete X-Next-Cursor
+    (et Link rel="next"). `fields` restreint les colonnes renvoyees.
+    """
+    site_slug = request.args.get('site', '')
+    set_code = request.args.get('set', '')
+    in_stock = request.args.get('in_stock', '')
+    sort = request.args.get('sort', 'price_asc')
+    search = request.args.get('search', '')
+    match = fts_match_query(search) if search and PRODUCTS_FTS_ENABLED else ''
+    if sort not in PRODUCT_SORT_KEYS or (sort == 'relevance' and not match):
+        sort = 'price_asc'
+
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or list(PRODUCT_FIELDS)
+    unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+    if unknown:
+        return jsonify({"error": f"Champs inconnus: {', '.join(unknown)}"}), 400
     try:
-        db = get_db()
-        site_slug = request.args.get('site', '')
-        set_code = request.args.get('set', '')
-        in_stock = request.args.get('in_stock', '')
-        sort = request.args.get('sort', 'price_asc')
-        search = request.args.get('search', '')
+        limit = int(request.args.get('limit', PRODUCTS_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return jsonify({"error": "Parametre limit invalide (entier positif attendu)"}), 400
+    limit = min(limit, PRODUCTS_MAX_LIMIT)
+
+    keys = PRODUCT_SORT_KEYS[sort]
+    cursor_values = None
+    if request.args.get('cursor'):
+        try:
+            cursor_values = decode_cursor(request.args['cursor'], sort)
+        except ValueError as e:
+            return jsonify({"error": f"Parametre cursor invalide ({e})"}), 400
 
-        query = """
-            SELECT p.id, p.name, p.set_code, p.url, p.image_url,
-                   p.first_seen, p.last_seen,
-                   s.name as site_name, s.slug as site_slug, s.url as site_url,
-                   ph.price, ph.in_stock, ph.checked_at
+    try:
+        db = get_db()
+        columns = [f"{PRODUCT_FIELDS[f]} AS {f}" for f in fields]
+        columns += [f"{expr} AS _k{i}" for i, (expr, _) in enumerate(keys)]
+        query = f"""
+            SELECT {', '.join(columns)}
             FROM products p
             JOIN sites s ON p.site_id = s.id
-            LEFT JOIN price_history ph ON ph.id = (
-                SELECT id FROM price_history
-                WHERE product_id = p.id ORDER BY checked_at DESC LIMIT 1
-            )
-            WHERE 1=1
+            LEFT JOIN product_latest pl ON pl.product_id = p.id
         """
         params = []
+        if sort == 'relevance':
+            # Jointure directe sur l'index pour exposer son rang bm25
+            query += " JOIN products_fts ON products_fts.rowid = p.id WHERE products_fts MATCH ?"
+            params.append(match)
+        else:
+            query += " WHERE 1=1"
 
         if site_slug:
             query += " AND s.slug = ?"
@@ -1142,24 +3931,34 @@ def api_products():
             query += " AND p.set_code = ?"
             params.append(set_code)
         if in_stock == '1':
-            query += " AND ph.in_stock = 1"
+            query += " AND pl.in_stock = 1"
         elif in_stock == '0':
-            query += " AND (ph.in_stock = 0 OR ph.in_stock IS NULL)"
-        if search:
-            query += " AND p.name LIKE ?"
-            params.append(f"%{search}%")
-
-        if sort == 'price_asc':
-            query += " ORDER BY CASE WHEN ph.price IS NULL THEN 1 ELSE 0 END, ph.price ASC"
-        elif sort == 'price_desc':
-            query += " ORDER BY ph.price DESC"
-        elif sort == 'name':
-            query += " ORDER BY p.name ASC"
-        elif sort == 'recent':
-            query += " ORDER BY ph.checked_at DESC"
+            query += " AND (pl.in_stock = 0 OR pl.in_stock IS NULL)"
+        if search and sort != 'relevance':
+            condition, search_params = search_condition(search)
+            query += f" AND {condition}"
+            params.extend(search_params)
+        if cursor_values is not None:
+            query += " AND " + keyset_condition(keys)
+            params.extend(keyset_params(cursor_values))
+
+        query += " ORDER BY " + ', '.join(f"{expr} {direction}" for expr, direction in keys)
+        # Une ligne de plus que la page pour savoir s'il reste une suite
+        query += " LIMIT ?"
+        params.append(limit + 1)
 
-        products = db.execute(query, params).fetchall()
-        return jsonify([dict(p) for p in products]), 200
+        rows = db.execute(query, params).fetchall()
+        page = rows[:limit]
+        response = jsonify([{f: row[f] for f in fields} for row in page])
+
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor(sort, [last[f'_k{i}'] for i in range(len(keys))])
+            next_args = request.args.to_dict()
+            next_args['cursor'] = next_cursor
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{request.path}?{urlencode(next_args)}>; rel="next"'
+        return response, 200
 
     except sqlite3.Error as e:
         logger.error(f"Erreur DB produits: {e}")
@@ -1167,6 +3966,7 @@ def api_products():
 
 
 @app.route('/api/products/grouped')
+@cached_response
 def api_products_grouped():
     """Produits regroupes par set_code avec comparaison des boutiques."""
     try:
@@ -1178,14 +3978,11 @@ def api_products_grouped():
         query = """
             SELECT p.id, p.name, p.set_code, p.url, p.image_url,
                    s.name as site_name, s.slug as site_slug,
-                   ph.price, ph.in_stock, ph.checked_at,
-                   COALESCE(ph.preorder, 0) as preorder
+                   pl.price, pl.in_stock, pl.checked_at,
+                   COALESCE(pl.preorder, 0) as preorder
             FROM products p
             JOIN sites s ON p.site_id = s.id
-            LEFT JOIN price_history ph ON ph.id = (
-                SELECT id FROM price_history
-                WHERE product_id = p.id ORDER BY checked_at DESC LIMIT 1
-            )
+            LEFT JOIN product_latest pl ON pl.product_id = p.id
             WHERE p.set_code IS NOT NULL
         """
         params = []
@@ -1194,14 +3991,15 @@ def api_products_grouped():
             query += " AND p.set_code = ?"
             params.append(set_filter)
         if stock_filter == '1':
-            query += " AND ph.in_stock = 1"
+            query += " AND pl.in_stock = 1"
         elif stock_filter == '0':
-            query += " AND (ph.in_stock = 0 OR ph.in_stock IS NULL)"
+            query += " AND (pl.in_stock = 0 OR pl.in_stock IS NULL)"
         if search:
-            query += " AND p.name LIKE ?"
-            params.append(f"%{search}%")
+            condition, search_params = search_condition(search)
+            query += f" AND {condition}"
+            params.extend(search_params)
 
-        query += " ORDER BY p.set_code, ph.price ASC"
+        query += " ORDER BY p.set_code, pl.price ASC"
         rows = db.execute(query, params).fetchall()
 
         # Regrouper par set_code
@@ -1265,9 +4063,75 @@ def api_products_grouped():
         return jsonify({"error": "Erreur base de donnees"}), 500
 
 
+def expand_history(history, step_minutes):
+    """Re-developpe un historique compact (une ligne par changement) en timeline.
+
+    Chaque ligne couvre [checked_at, last_confirmed_at] : un point est genere
+    tous les `step_minutes` sur cet intervalle, plus le point final.
+    """
+    fmt = '%Y-%m-%d %H:%M:%S'
+    step = timedelta(minutes=max(1, step_minutes))
+    points = []
+    for row in history:
+        start = datetime.strptime(row['checked_at'], fmt)
+        end = datetime.strptime(row['last_confirmed_at'], fmt)
+        state = {k: v for k, v in row.items() if k not in ('checked_at', 'last_confirmed_at')}
+        current = start
+        while current < end:
+            points.append({**state, 'checked_at': current.strftime(fmt)})
+            current += step
+        points.append({**state, 'checked_at': end.strftime(fmt)})
+    return points
+
+
+def parse_history_bound(value):
+    """Convertit un parametre from/to (ISO) au format des dates SQLite."""
+    return datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def choose_history_resolution(db, product_id, start, end):
+    """Choisit la resolution la plus fine tenant dans HISTORY_MAX_POINTS points."""
+    raw_points = db.execute(
+        """SELECT COUNT(*) FROM price_history
+           WHERE product_id = ? AND checked_at <= ?
+             AND COALESCE(last_confirmed_at, checked_at) >= ?""",
+        (product_id, end, start)
+    ).fetchone()[0]
+    if raw_points <= HISTORY_MAX_POINTS:
+        return 'raw'
+
+    # Etendue reelle : `from` vaut 2000-01-01 par defaut, on part donc du
+    # premier releve du produit
+    first = db.execute(
+        "SELECT MIN(checked_at) FROM price_history WHERE product_id = ?", (product_id,)
+    ).fetchone()[0]
+    if first and first > start:
+        start = first
+    fmt = '%Y-%m-%d %H:%M:%S'
+    span_hours = (datetime.strptime(end, fmt) - datetime.strptime(start, fmt)).total_seconds() / 3600
+    if span_hours <= HISTORY_MAX_POINTS:
+        return 'hour'
+    return 'day'
+
+
 @app.route('/api/products/<int:product_id>/history')
 def api_product_history(product_id):
-    """Historique des prix d'un produit."""
+    """Historique des prix d'un produit.
+
+    Parametres : `from` / `to` (dates ISO), `resolution` (`auto`, `raw`,
+    `hour`, `day`) et `expand=1` (timeline complete, resolution `raw`).
+    En `auto`, la resolution la plus fine tenant dans HISTORY_MAX_POINTS
+    points est utilisee : brut, puis agregats horaires, puis journaliers.
+    """
+    resolution = request.args.get('resolution', 'auto')
+    if resolution not in ('auto', 'raw', 'hour', 'day'):
+        return jsonify({"error": "Resolution invalide (auto, raw, hour, day)"}), 400
+    try:
+        start = parse_history_bound(request.args.get('from', '2000-01-01'))
+        end = parse_history_bound(request.args.get('to') or datetime.utcnow().isoformat())
+    except ValueError:
+        return jsonify({"error": "Parametres from/to invalides (format ISO attendu)"}), 400
+
     try:
         db = get_db()
         product = db.execute(
@@ -1280,16 +4144,50 @@ def api_product_history(product_id):
         if not product:
             return jsonify({"error": "Produit non trouve"}), 404
 
-        history = db.execute(
-            """SELECT price, in_stock, checked_at
-               FROM price_history WHERE product_id = ?
-               ORDER BY checked_at ASC""",
-            (product_id,)
-        ).fetchall()
+        if request.args.get('expand') == '1':
+            resolution = 'raw'
+        elif resolution == 'auto':
+            resolution = choose_history_resolution(db, product_id, start, end)
+
+        if resolution == 'raw':
+            history = db.execute(
+                """SELECT price, in_stock, preorder, checked_at,
+                          COALESCE(last_confirmed_at, checked_at) as last_confirmed_at
+                   FROM price_history
+                   WHERE product_id = ? AND checked_at <= ?
+                     AND COALESCE(last_confirmed_at, checked_at) >= ?
+                   ORDER BY checked_at ASC""",
+                (product_id, end, start)
+            ).fetchall()
+            history = [dict(h) for h in history]
+            if request.args.get('expand') == '1':
+                history = expand_history(history, SCAN_INTERVAL_MINUTES)
+        else:
+            table = 'price_rollup_hourly' if resolution == 'hour' else 'price_rollup_daily'
+            rows = db.execute(
+                f"""SELECT bucket, min_price, max_price, last_price,
+                           samples, in_stock_samples
+                    FROM {table}
+                    WHERE product_id = ? AND bucket >= ? AND bucket <= ?
+                    ORDER BY bucket ASC""",
+                (product_id, start[:13] if resolution == 'hour' else start[:10], end)
+            ).fetchall()
+            history = []
+            for row in rows:
+                ratio = row['in_stock_samples'] / row['samples'] if row['samples'] else 0
+                history.append({
+                    'checked_at': row['bucket'],
+                    'price': row['last_price'],
+                    'min_price': row['min_price'],
+                    'max_price': row['max_price'],
+                    'in_stock': 1 if ratio >= 0.5 else 0,
+                    'in_stock_ratio': round(ratio, 3),
+                })
 
         return jsonify({
             "product": dict(product),
-            "history": [dict(h) for h in history],
+            "resolution": resolution,
+            "history": history,
         }), 200
 
     except sqlite3.Error as e:
@@ -1310,6 +4208,7 @@ def api_sites():
 
 
 @app.route('/api/sets')
+@cached_response
 def api_sets():
     """Liste des sets One Piece detectes."""
     try:
@@ -1324,43 +4223,31 @@ def api_sets():
 
 
 @app.route('/api/stats')
+@cached_response
 def api_stats():
     """Statistiques du dashboard."""
     try:
         db = get_db()
 
         total = db.execute("SELECT COUNT(*) as c FROM products").fetchone()['c']
-        in_stock = db.execute("""
-            SELECT COUNT(DISTINCT p.id) as c FROM products p
-            JOIN price_history ph ON ph.id = (
-                SELECT id FROM price_history WHERE product_id = p.id
-                ORDER BY checked_at DESC LIMIT 1
-            ) WHERE ph.in_stock = 1
-        """).fetchone()['c']
+        in_stock_row = db.execute("""
+            SELECT COUNT(*) as c, AVG(pl.price) as avg_price, MIN(pl.price) as best_price
+            FROM product_latest pl
+            JOIN products p ON p.id = pl.product_id
+            WHERE pl.in_stock = 1
+        """).fetchone()
+        in_stock = in_stock_row['c']
+        avg_price = in_stock_row['avg_price']
+        best_price = in_stock_row['best_price']
         total_sites = db.execute(
             "SELECT COUNT(*) as c FROM sites WHERE enabled = 1"
         ).fetchone()['c']
 
-        avg_price = db.execute("""
-            SELECT AVG(ph.price) as v FROM products p
-            JOIN price_history ph ON ph.id = (
-                SELECT id FROM price_history WHERE product_id = p.id
-                ORDER BY checked_at DESC LIMIT 1
-            ) WHERE ph.in_stock = 1 AND ph.price IS NOT NULL
-        """).fetchone()['v']
-
-        best_price = db.execute("""
-            SELECT MIN(ph.price) as v FROM products p
-            JOIN price_history ph ON ph.id = (
-                SELECT id FROM price_history WHERE product_id = p.id
-                ORDER BY checked_at DESC LIMIT 1
-            ) WHERE ph.in_stock = 1 AND ph.price IS NOT NULL
-        """).fetchone()['v']
-
-        # Recuperer le dernier scan depuis la BDD (fiable multi-worker)
+        # Recuperer le dernier scan termine depuis la BDD (fiable multi-worker),
+        # scan complet ou scan par site
         scan_row = db.execute(
             "SELECT started_at, finished_at FROM scan_log "
-            "ORDER BY id DESC LIMIT 1"
+            "WHERE finished_at IS NOT NULL ORDER BY id DESC LIMIT 1"
         ).fetchone()
         scan_info = {
             'finished_at': scan_row['finished_at'] if scan_row else None,
@@ -1389,14 +4276,11 @@ def api_trigger_scan():
     if last_scan_info['running']:
         return jsonify({"error": "Scan deja en cours"}), 409
 
-    # Verifier en BDD si un scan tourne sur un autre worker
     try:
         db = get_db()
         row = db.execute(
-            "SELECT finished_at FROM scan_log ORDER BY id DESC LIMIT 1"
+            "SELECT finished_at FROM scan_log WHERE site_id IS NULL ORDER BY id DESC LIMIT 1"
         ).fetchone()
-        if row and row['finished_at'] is None:
-            return jsonify({"error": "Scan deja en cours"}), 409
         if row and row['finished_at']:
             last_finish = datetime.fromisoformat(row['finished_at'])
             if (datetime.now() - last_finish).total_seconds() < 60:
@@ -1404,6 +4288,18 @@ def api_trigger_scan():
     except Exception:
         pass
 
+    # Prendre le bail 'scan' ici : refus immediat si un autre worker scanne,
+    # ou si un scan par site est en cours (run_scan le renouvelle ensuite,
+    # meme detenteur, et le rend s'il abandonne)
+    try:
+        if active_site_leases(get_db()):
+            return jsonify({"error": "Scan de site en cours, reessayez dans un instant"}), 409
+        if not acquire_lease('scan'):
+            return jsonify({"error": "Scan deja en cours"}), 409
+    except sqlite3.Error as e:
+        logger.error(f"Bail de scan indisponible: {e}")
+        return jsonify({"error": "Base de donnees occupee"}), 503
+
     thread = threading.Thread(target=run_scan, daemon=True)
     thread.start()
     return jsonify({"message": "Scan lance"}), 202
@@ -1421,14 +4317,19 @@ def api_scan_status():
     try:
         db = get_db()
         row = db.execute(
-            "SELECT started_at, finished_at, results FROM scan_log "
-            "ORDER BY id DESC LIMIT 1"
+            "SELECT id, started_at, finished_at, results FROM scan_log "
+            "WHERE site_id IS NULL ORDER BY id DESC LIMIT 1"
         ).fetchone()
         if row:
             if row['finished_at'] is None:
-                # Scan en cours sur un autre worker
+                # Scan en cours sur un autre worker : progression lue dans la file
                 info['running'] = True
                 info['started_at'] = row['started_at']
+                info['results'] = scan_job_results(db, row['id'])
+                info['sites_done'] = len(info['results'])
+                info['sites_total'] = db.execute(
+                    "SELECT COUNT(*) FROM scan_jobs WHERE scan_id = ?", (row['id'],)
+                ).fetchone()[0]
             else:
                 info['finished_at'] = row['finished_at']
                 info['started_at'] = row['started_at']
@@ -1436,52 +4337,92 @@ def api_scan_status():
                     info['results'] = json.loads(row['results']) if row['results'] else {}
                 except (json.JSONDecodeError, TypeError):
                     info['results'] = {}
+        if not info.get('running'):
+            # Scans par site termines depuis : leurs resultats remplacent ceux
+            # du dernier scan complet pour leur site
+            for site_row in db.execute(
+                "SELECT finished_at, results FROM scan_log "
+                "WHERE site_id IS NOT NULL AND id > ? AND finished_at IS NOT NULL ORDER BY id",
+                (row['id'] if row else 0,)
+            ):
+                info['finished_at'] = max(info.get('finished_at') or '', site_row['finished_at'])
+                try:
+                    info['results'] = dict(info.get('results') or {}, **json.loads(site_row['results']))
+                except (json.JSONDecodeError, TypeError):
+                    pass
     except Exception:
         pass
 
     return jsonify(info), 200
 
 
-_SSE_MAX_CLIENTS = 4
+@app.route('/api/metrics')
+def api_metrics():
+    """Metriques internes (HTTP, SQLite, cache, maintenance, planification, reassorts, bails)."""
+    return jsonify({
+        'http': http_pool_stats(),
+        'db': db_pool_stats(),
+        'response_cache': response_cache_stats(),
+        'maintenance': last_maintenance_info,
+        'scan_schedule': scan_schedule_stats(),
+        'restock_watch': last_restock_watch_info,
+        'leases': lease_stats(),
+        'sse': sse_stats(),
+    }), 200
+
+
 _SSE_MAX_LIFETIME = 300  # 5 minutes, puis le client reconnecte automatiquement
 
 
 @app.route('/api/scan/stream')
 def scan_stream():
-    """Endpoint SSE pour les mises a jour de scan en temps reel."""
-    with _sse_lock:
-        if len(_sse_clients) >= _SSE_MAX_CLIENTS:
-            return jsonify({"error": "Trop de connexions SSE"}), 429
+    """Endpoint SSE pour les mises a jour de scan en temps reel.
 
-    client_queue = queue.Queue(maxsize=50)
-    with _sse_lock:
-        _sse_clients.append(client_queue)
+    Un client qui se reconnecte avec Last-Event-ID recoit les evenements
+    manques encore presents dans le tampon ; sinon (premiere connexion,
+    evenements perdus, autre worker) il recoit l'etat courant du scan.
+    """
+    with _sse_cond:
+        if _sse_state['clients'] >= SSE_MAX_CLIENTS:
+            return jsonify({"error": "Trop de connexions SSE"}), 429
 
-    initial = {
-        'running': last_scan_info['running'],
-        'started_at': last_scan_info.get('started_at'),
-        'finished_at': last_scan_info.get('finished_at'),
-    }
+    cursor = sse_cursor(request.headers.get('Last-Event-ID'))
     start_time = time.time()
 
+    def status_frame(seq):
+        """Etat courant du scan, porteur du curseur pour une reprise ulterieure."""
+        status = {
+            'running': last_scan_info['running'],
+            'started_at': last_scan_info.get('started_at'),
+            'finished_at': last_scan_info.get('finished_at'),
+        }
+        return f"id: {_sse_epoch}-{seq}\nevent: scan:status\ndata: {json.dumps(status)}\n\n"
+
     def generate():
         """Generateur SSE avec keepalive et duree de vie limitee."""
-        # Padding pour forcer le flush des proxies (Cloudflare, Nginx, etc.)
-        yield ": " + " " * 2048 + "\n\n"
-        yield f"event: scan:status\ndata: {json.dumps(initial)}\n\n"
+        nonlocal cursor
+        with _sse_cond:
+            _sse_state['clients'] += 1
         try:
+            # Padding pour forcer le flush des proxies (Cloudflare, Nginx, etc.)
+            yield ": " + " " * 2048 + "\n\n"
+            if cursor is None:
+                with _sse_cond:
+                    cursor = _sse_state['seq']
+                yield status_frame(cursor)
             while time.time() - start_time < _SSE_MAX_LIFETIME:
-                try:
-                    msg = client_queue.get(timeout=10)
-                    yield f"event: {msg['event']}\ndata: {json.dumps(msg['data'])}\n\n"
-                except queue.Empty:
+                frames, cursor, lost = sse_events_after(cursor, timeout=10)
+                if lost:
+                    yield status_frame(cursor)
+                elif frames:
+                    yield ''.join(frames)
+                else:
                     yield ": keepalive\n\n"
         except GeneratorExit:
             pass
         finally:
-            with _sse_lock:
-                if client_queue in _sse_clients:
-                    _sse_clients.remove(client_queue)
+            with _sse_cond:
+                _sse_state['clients'] -= 1
 
     return Response(
         generate(),
@@ -1509,7 +4450,9 @@ def index():
 # ============================================================
 
 # Initialiser le scheduler au chargement du module (gunicorn compatible)
-init_scheduler()
+if not IN_PARSE_WORKER and not RUN_AS_WORKER:
+    init_scheduler()
+    atexit.register(shutdown_parse_pool)
 
 if __name__ == '__main__':
     if not DB_PATH.exists():
@@ -1517,6 +4460,10 @@ if __name__ == '__main__':
         logger.info("Executez 'python setup.py' d'abord")
         exit(1)
 
+    if RUN_AS_WORKER:
+        run_worker()
+        exit(0)
+
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
     logger.info(f"OP Stock Monitor v{__version__} demarre sur le port {port}")
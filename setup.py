@@ -9,6 +9,8 @@ import os
 DB_PATH = Path(os.getenv('DATABASE_PATH', 'data/app.db'))
 
 INITIAL_SITES = [
+    # Boutique Shopify : des URLs /products.json suffisent (scraper generique
+    # scrape_shopify, utilise aussi pour tout site absent du registre)
     {
         'name': 'RelicTCG',
         'slug': 'relictcg',
@@ -90,6 +92,10 @@ def init_database():
 
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    # Sans effet sur une base existante (converti au demarrage par migrate_db)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Journal WAL : lectures concurrentes pendant les ecritures du scanner
+    cursor.execute("PRAGMA journal_mode = WAL")
 
     cursor.executescript("""
         CREATE TABLE IF NOT EXISTS sites (
@@ -121,14 +127,105 @@ def init_database():
             in_stock INTEGER DEFAULT 0,
             preorder INTEGER DEFAULT 0,
             checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_confirmed_at TIMESTAMP,
             FOREIGN KEY (product_id) REFERENCES products(id)
         );
 
+        CREATE TABLE IF NOT EXISTS product_latest (
+            product_id INTEGER PRIMARY KEY,
+            history_id INTEGER,
+            price REAL,
+            in_stock INTEGER DEFAULT 0,
+            preorder INTEGER DEFAULT 0,
+            checked_at TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS price_rollup_hourly (
+            product_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            min_price REAL,
+            max_price REAL,
+            last_price REAL,
+            samples INTEGER DEFAULT 0,
+            in_stock_samples INTEGER DEFAULT 0,
+            last_at TIMESTAMP,
+            PRIMARY KEY (product_id, bucket)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS price_rollup_daily (
+            product_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            min_price REAL,
+            max_price REAL,
+            last_price REAL,
+            samples INTEGER DEFAULT 0,
+            in_stock_samples INTEGER DEFAULT 0,
+            last_at TIMESTAMP,
+            PRIMARY KEY (product_id, bucket)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS url_cache (
+            url TEXT PRIMARY KEY,
+            site_id INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            products TEXT,
+            pages TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (site_id) REFERENCES sites(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scan_id INTEGER NOT NULL,
+            site_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            heartbeat_at REAL,
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (scan_id) REFERENCES scan_log(id),
+            FOREIGN KEY (site_id) REFERENCES sites(id)
+        );
+
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+
+        -- Compteur des modifications de products (version des donnees du cache API)
+        CREATE TABLE IF NOT EXISTS data_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            products INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO data_changes (id) VALUES (1);
+        CREATE TRIGGER IF NOT EXISTS products_changed_insert AFTER INSERT ON products BEGIN
+            UPDATE data_changes SET products = products + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_changed_delete AFTER DELETE ON products BEGIN
+            UPDATE data_changes SET products = products + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_changed_update
+        AFTER UPDATE OF name, set_code, image_url ON products
+        WHEN old.name IS NOT new.name OR old.set_code IS NOT new.set_code
+          OR old.image_url IS NOT new.image_url BEGIN
+            UPDATE data_changes SET products = products + 1;
+        END;
+
         CREATE TABLE IF NOT EXISTS scan_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             started_at TEXT,
             finished_at TEXT,
-            results TEXT
+            results TEXT,
+            site_id INTEGER,
+            FOREIGN KEY (site_id) REFERENCES sites(id)
         );
 
         CREATE INDEX IF NOT EXISTS idx_products_site ON products(site_id);
@@ -136,8 +233,35 @@ def init_database():
         CREATE INDEX IF NOT EXISTS idx_products_url ON products(url);
         CREATE INDEX IF NOT EXISTS idx_history_product ON price_history(product_id);
         CREATE INDEX IF NOT EXISTS idx_history_date ON price_history(checked_at);
+        CREATE INDEX IF NOT EXISTS idx_scan_jobs_status ON scan_jobs(status, id);
+        CREATE INDEX IF NOT EXISTS idx_scan_jobs_scan ON scan_jobs(scan_id);
+        CREATE INDEX IF NOT EXISTS idx_scan_log_site ON scan_log(site_id, id);
+        CREATE INDEX IF NOT EXISTS idx_latest_stock ON product_latest(in_stock, price);
     """)
 
+    # Index plein texte des noms (FTS5, insensible aux accents) et triggers de synchro
+    try:
+        cursor.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, content='products', content_rowid='id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products
+            WHEN old.name IS NOT new.name BEGIN
+                INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+            END;
+        """)
+        cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 indisponible, recherche par LIKE: {e}")
+
     # Nettoyer les anciens sites et donnees orphelines
     existing_slugs = [s['slug'] for s in INITIAL_SITES]
     placeholders = ','.join('?' * len(existing_slugs))
@@ -147,6 +271,29 @@ def init_database():
         f"WHERE s.slug NOT IN ({placeholders}))",
         existing_slugs,
     )
+    cursor.execute(
+        f"DELETE FROM product_latest WHERE product_id IN "
+        f"(SELECT p.id FROM products p JOIN sites s ON p.site_id = s.id "
+        f"WHERE s.slug NOT IN ({placeholders}))",
+        existing_slugs,
+    )
+    for rollup_table in ('price_rollup_hourly', 'price_rollup_daily'):
+        cursor.execute(
+            f"DELETE FROM {rollup_table} WHERE product_id IN "
+            f"(SELECT p.id FROM products p JOIN sites s ON p.site_id = s.id "
+            f"WHERE s.slug NOT IN ({placeholders}))",
+            existing_slugs,
+        )
+    cursor.execute(
+        f"DELETE FROM scan_jobs WHERE site_id IN "
+        f"(SELECT id FROM sites WHERE slug NOT IN ({placeholders}))",
+        existing_slugs,
+    )
+    cursor.execute(
+        f"DELETE FROM url_cache WHERE site_id IN "
+        f"(SELECT id FROM sites WHERE slug NOT IN ({placeholders}))",
+        existing_slugs,
+    )
     cursor.execute(
         f"DELETE FROM products WHERE site_id IN "
         f"(SELECT id FROM sites WHERE slug NOT IN ({placeholders}))",
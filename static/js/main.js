@@ -8,6 +8,7 @@ let searchTimeout = null;
 let eventSource = null;
 let pollTimer = null;
 let wasRunning = false;
+let refreshTimeout = null;
 
 /* ------------------------------------------------------------
    Initialisation
@@ -56,6 +57,26 @@ function toggleSidebar() {
    Chargement des donnees
    ------------------------------------------------------------ */
 
+/* Derniere reponse par URL avec son ETag : un rechargement inchange
+   est servi par le serveur en 304 (sans corps) et reutilise ces donnees */
+let jsonCache = {};
+
+async function fetchJSON(url) {
+    var cached = jsonCache[url];
+    var headers = {};
+    if (cached) headers['If-None-Match'] = cached.etag;
+
+    var resp = await fetch(url, { headers: headers, cache: 'no-store' });
+    if (resp.status === 304 && cached) return cached.data;
+
+    var data = await resp.json();
+    var etag = resp.headers.get('ETag');
+    if (resp.ok && etag) {
+        jsonCache[url] = { etag: etag, data: data };
+    }
+    return data;
+}
+
 async function loadProducts() {
     var params = new URLSearchParams();
     var set = document.getElementById('filter-set').value;
@@ -67,8 +88,7 @@ async function loadProducts() {
     if (search) params.set('search', search);
 
     try {
-        var resp = await fetch('/api/products/grouped?' + params.toString());
-        groups = await resp.json();
+        groups = await fetchJSON('/api/products/grouped?' + params.toString());
         renderGroups(groups);
     } catch (e) {
         console.error('Erreur chargement produits:', e);
@@ -77,8 +97,7 @@ async function loadProducts() {
 
 async function loadStats() {
     try {
-        var resp = await fetch('/api/stats');
-        var stats = await resp.json();
+        var stats = await fetchJSON('/api/stats');
         renderStats(stats);
     } catch (e) {
         console.error('Erreur chargement stats:', e);
@@ -87,10 +106,11 @@ async function loadStats() {
 
 async function loadSets() {
     try {
-        var resp = await fetch('/api/sets');
-        var sets = await resp.json();
+        var sets = await fetchJSON('/api/sets');
         var select = document.getElementById('filter-set');
         sets.forEach(function(s) {
+            /* Appele a nouveau apres chaque scan : ne pas dupliquer les options */
+            if (Array.from(select.options).some(function(o) { return o.value === s; })) return;
             var opt = document.createElement('option');
             opt.value = s;
             opt.textContent = s;
@@ -292,11 +312,26 @@ async function triggerScan() {
    SSE (Server-Sent Events) - Mises a jour temps reel
    ------------------------------------------------------------ */
 
+/* Une passe de surveillance envoie un evenement par produit modifie :
+   un seul rechargement pour une rafale d'evenements */
+function scheduleRefresh() {
+    if (refreshTimeout) clearTimeout(refreshTimeout);
+    refreshTimeout = setTimeout(function() {
+        refreshTimeout = null;
+        loadProducts();
+        loadStats();
+        loadSets();
+    }, 1000);
+}
+
 function initSSE() {
     if (eventSource) eventSource.close();
 
     eventSource = new EventSource('/api/scan/stream');
+    var synced = false;
 
+    /* Recu a la connexion, ou a une reconnexion dont les evenements manques
+       ne peuvent pas etre rejoues : les donnees affichees sont alors rechargees */
     eventSource.addEventListener('scan:status', function(e) {
         var data = JSON.parse(e.data);
         if (data.running) {
@@ -304,6 +339,12 @@ function initSSE() {
         } else if (data.finished_at) {
             updateLastScanTime(data.finished_at);
         }
+        if (synced) {
+            loadProducts();
+            loadStats();
+            loadSets();
+        }
+        synced = true;
     });
 
     eventSource.addEventListener('scan:started', function(e) {
@@ -326,6 +367,19 @@ function initSSE() {
         loadSets();
     });
 
+    /* Scan planifie d'un site dont les donnees ont change */
+    eventSource.addEventListener('site:updated', function(e) {
+        scheduleRefresh();
+    });
+
+    eventSource.addEventListener('product:update', function(e) {
+        var data = JSON.parse(e.data);
+        if (data.restock) {
+            showToast('Reassort : ' + data.name + ' (' + data.site_name + ')', 'success');
+        }
+        scheduleRefresh();
+    });
+
     eventSource.onerror = function() {
         /* EventSource reconnecte automatiquement */
     };
@@ -447,11 +501,20 @@ function renderPriceChart(history) {
     var labels = [];
     var prices = [];
     var bgColors = [];
+    var points = [];
 
+    // Historique compact : chaque ligne vaut de checked_at a last_confirmed_at
     history.forEach(function(h) {
-        labels.push(formatDateTime(new Date(h.checked_at)));
-        prices.push(h.price);
-        bgColors.push(h.in_stock ? 'rgba(16, 185, 129, 0.8)' : 'rgba(239, 68, 68, 0.8)');
+        points.push({ at: h.checked_at, row: h });
+        if (h.last_confirmed_at && h.last_confirmed_at !== h.checked_at) {
+            points.push({ at: h.last_confirmed_at, row: h });
+        }
+    });
+
+    points.forEach(function(p) {
+        labels.push(formatDateTime(new Date(p.at)));
+        prices.push(p.row.price);
+        bgColors.push(p.row.in_stock ? 'rgba(16, 185, 129, 0.8)' : 'rgba(239, 68, 68, 0.8)');
     });
 
     var isDark = document.documentElement.getAttribute('data-theme') === 'dark';
@@ -484,9 +547,13 @@ function renderPriceChart(history) {
                 tooltip: {
                     callbacks: {
                         label: function(ctx) {
-                            var h = history[ctx.dataIndex];
+                            var h = points[ctx.dataIndex].row;
                             var stock = h.in_stock ? 'En stock' : 'Rupture';
                             var price = ctx.parsed.y !== null ? ctx.parsed.y.toFixed(2) + ' \u20ac' : 'N/A';
+                            // Agregats horaires/journaliers : afficher la fourchette de prix
+                            if (h.min_price != null && h.max_price != null && h.min_price !== h.max_price) {
+                                price += ' [' + h.min_price.toFixed(2) + ' - ' + h.max_price.toFixed(2) + ']';
+                            }
                             return price + ' (' + stock + ')';
                         }
                     }
@@ -524,7 +591,11 @@ function renderHistoryTable(history) {
             ? '<span class="badge badge-stock">\u25CF En stock</span>'
             : '<span class="badge badge-oos">\u25CF Rupture</span>';
         var price = h.price !== null ? h.price.toFixed(2) + ' \u20ac' : '-';
-        rows += '<tr><td>' + formatDateTime(new Date(h.checked_at)) + '</td><td>' + price + '</td><td>' + stockBadge + '</td></tr>';
+        var date = formatDateTime(new Date(h.checked_at));
+        if (h.last_confirmed_at && h.last_confirmed_at !== h.checked_at) {
+            date += ' \u2192 ' + formatDateTime(new Date(h.last_confirmed_at));
+        }
+        rows += '<tr><td>' + date + '</td><td>' + price + '</td><td>' + stockBadge + '</td></tr>';
     });
 
     wrapper.innerHTML =